@@ -1,7 +1,12 @@
 from .assign_roles import AssignRoles
 
 
-__red_end_user_data_statement__ = "No user data is stored by this cog."
+__red_end_user_data_statement__ = (
+    "This cog keeps an audit log of the roles that were assigned or removed through it, "
+    "which stores the user IDs of the one who assigned the role and of the one who received it.\n"
+    "As this log is kept for moderation purposes, users cannot have their entries removed. "
+    "The user IDs of deleted Discord accounts are erased from it."
+)
 
 
 async def setup(bot):
@@ -1,9 +1,18 @@
+from __future__ import annotations
+
+import os.path
+import time
+from collections import defaultdict
+
 import discord
 
 from redbot.core import commands  # Changed from discord.ext
-from redbot.core import Config
+from redbot.core import Config, data_manager
 from redbot.core.bot import Red
 
+from .audit_log import AuditLog, AuditRecord
+from .role_edit_queue import RoleEditQueue
+
 
 class AssignRoles(commands.Cog):
     """Authorise one role to give another role"""
@@ -16,6 +25,11 @@ class AssignRoles(commands.Cog):
 
     ASSIGN_ADDED = DONE + "Successfully assigned the `{}` role."
     ASSIGN_REMOVED = BIN + "Successfully removed the `{}` role."
+    # When other assign commands for the same member were merged into one edit.
+    ASSIGN_MERGED_HAS = DONE + "Merged with another assign command: {} now has the `{}` role."
+    ASSIGN_MERGED_LACKS = (
+        BIN + "Merged with another assign command: {} does not have the `{}` role."
+    )
     ASSIGN_NO_EVERYONE = ERROR + "You cannot give someone the Everyone role!"
     AUTHORISE_EXISTS = (
         ERROR + "The role you want to authorised is already authorised to give this role."
@@ -30,14 +44,72 @@ class AssignRoles(commands.Cog):
     DEAUTHORISE_SUCCESS = BIN + "Successfully de-authorised `{}` to assign the `{}` role."
     LIST_DESC_NORMAL = "The roles below can be given by the mentioned roles."
     LIST_DESC_EMPTY = "No roles are authorised to give other roles."
+    INHERIT_EXISTS = ERROR + "`{}` already inherits the authorisations of `{}`."
+    INHERIT_MISMATCH = ERROR + "`{}` does not inherit the authorisations of `{}`."
+    INHERIT_SELF = ERROR + "A role cannot inherit its own authorisations!"
+    INHERIT_SUCCESS = DONE + "`{}` can now give every role that `{}` can give."
+    UNINHERIT_SUCCESS = BIN + "`{}` no longer inherits the authorisations of `{}`."
+    RANGE_EXISTS = ERROR + "`{}` is already authorised to give the roles in this range."
+    RANGE_MISMATCH = ERROR + "`{}` is not authorised to give the roles in this range."
+    RANGE_SUCCESS = DONE + "`{}` can now give every role from `{}` up to `{}`."
+    UNRANGE_SUCCESS = BIN + "`{}` can no longer give the roles from `{}` up to `{}`."
+    RULES_DESC_EMPTY = "No inheritance or range rules are configured."
+    LOG_TITLE = "Assign log of {}"
+    LOG_EMPTY = "{} has no entries in the assign log."
+    LOG_LINE = "<t:{}:f> {} {} {} {} {}"  # Time, actor, action, role, preposition, target.
+    LOG_FOOTER = "Showing the latest {} of {} entries."
+    LOG_DELETED_USER = "*a deleted user*"
+    LOG_LIMIT = 20
+    # Config constants.
+    AUTH_GROUP = "ROLE_AUTH"  # Identifiers: guild ID, giveable role ID.
+    RULE_GROUP = "GIVER_RULES"  # Identifiers: guild ID, authorised role ID.
+    SCHEMA_VERSION = 1
 
     def __init__(self, bot: Red):
         super().__init__()
         self.bot = bot
         self.config = Config.get_conf(self, identifier=73600, force_registration=True)
-        self.config.register_guild(roles={})
+        self.config.register_global(schema_version=0)
+        self.config.register_guild(roles={})  # Legacy layout, only read by the migration.
+        self.config.init_custom(self.AUTH_GROUP, 2)
+        self.config.register_custom(self.AUTH_GROUP, authorised=[])
+        self.config.init_custom(self.RULE_GROUP, 2)
+        # inherits: role IDs whose authorisations are inherited.
+        # ranges: [bottom role ID, top role ID] pairs, both inclusive.
+        self.config.register_custom(self.RULE_GROUP, inherits=[], ranges=[])
+        # Effective authorisations per guild: {giveable role ID: frozenset of authorised role IDs}
+        self.closures: dict[int, dict[int, frozenset]] = {}
+        self.closure_generations: dict[int, int] = {}
+        self.FOLDER = str(data_manager.cog_data_path(self))
+        self.audit_log = AuditLog(os.path.join(self.FOLDER, "audit"))
+        self.edit_queue = RoleEditQueue()
+
+    async def cog_load(self):
+        """Migrate the Config data to the latest layout if needed, and start the audit log"""
+        if await self.config.schema_version() < self.SCHEMA_VERSION:
+            await self.migrate_roles_to_custom()
+        self.audit_log.start()
+
+    async def cog_unload(self):
+        self.edit_queue.stop()
+        await self.audit_log.close()
 
     # Events
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        """Invalidate the closure, as the new role may fall in a range rule"""
+        self.invalidate_closure(role.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        """Invalidate the closure, as role positions have shifted"""
+        self.invalidate_closure(role.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        """Invalidate the closure if the role hierarchy has changed"""
+        if before.position != after.position:
+            self.invalidate_closure(after.guild.id)
 
     # Commands
     @commands.guild_only()
@@ -47,23 +119,32 @@ class AssignRoles(commands.Cog):
         author = ctx.author
         if user is None:
             user = author
-        role_id = role.id
-        server_dict = await self.config.guild(ctx.guild).roles()
+        closure = await self.effective_authorisations(ctx.guild)
+        givers = closure.get(role.id, frozenset())
 
         if role.is_default():
             notice = self.ASSIGN_NO_EVERYONE
-        elif role_id not in server_dict:  # No role authorised to give this role.
+        elif not givers:  # No role authorised to give this role.
             notice = self.AUTHORISE_EMPTY.format(role.name)
         # Check if any of the author's roles is authorised to grant the role.
-        elif not any(r.id in server_dict[role_id] for r in author.roles):
+        elif not any(r.id in givers for r in author.roles):
             notice = self.AUTHORISE_MISMATCH.format(author.mention, role.name)
         else:  # Role "transaction" is valid.
-            if role in user.roles:
-                await user.remove_roles(role)
-                notice = self.ASSIGN_REMOVED.format(role.name)
+            # Toggles of the same member within a short window are sent as one edit.
+            added, edit_future = self.edit_queue.toggle(user, role)
+            role_ids, changed = await edit_future
+            has_role = role.id in role_ids
+            if has_role == added:
+                notice = (self.ASSIGN_ADDED if added else self.ASSIGN_REMOVED).format(role.name)
+            elif has_role:
+                notice = self.ASSIGN_MERGED_HAS.format(user.display_name, role.name)
             else:
-                await user.add_roles(role)
-                notice = self.ASSIGN_ADDED.format(role.name)
+                notice = self.ASSIGN_MERGED_LACKS.format(user.display_name, role.name)
+            # Only log what reached Discord, i.e. not the toggles that were merged away.
+            if role.id in changed:
+                now = int(time.time() * 1000)
+                record = AuditRecord(now, author.id, user.id, role.id, has_role)
+                self.audit_log.append(ctx.guild.id, record)
         await ctx.send(notice)
 
     @commands.guild_only()
@@ -78,26 +159,27 @@ class AssignRoles(commands.Cog):
          `authorised_role` (except for the owner).
         """
         gld = ctx.guild
-        server_dict = await self.config.guild(gld).roles()
-
         author_max_role = max(r for r in ctx.author.roles)
         authorised_id = authorised_role.id
-        giveable_id = giveable_role.id
-
-        if authorised_role.is_default():  # Role to be authorised should not be @everyone.
-            notice = self.AUTHORISE_NO_EVERYONE
-        elif giveable_role.is_default():  # Same goes for role to be given.
-            notice = self.AUTHORISE_NOT_DEFAULT
-        # Hierarchical role order check.
-        elif authorised_role >= author_max_role and ctx.author != gld.owner:
-            notice = self.AUTHORISE_NO_HIGHER
-        # Check if "pair" already exists.
-        elif giveable_id in server_dict and authorised_id in server_dict[giveable_id]:
-            notice = self.AUTHORISE_EXISTS
-        else:  # Role authorisation is valid.
-            server_dict.setdefault(giveable_id, []).append(authorised_id)
-            await self.config.guild(gld).roles.set(server_dict)
-            notice = self.AUTHORISE_SUCCESS.format(authorised_role.name, giveable_role.name)
+        auth_value = self.config.custom(self.AUTH_GROUP, gld.id, giveable_role.id).authorised
+
+        async with auth_value.get_lock():  # Only locks this giveable role's entry.
+            auth_list = await auth_value()
+            if authorised_role.is_default():  # Role to be authorised should not be @everyone.
+                notice = self.AUTHORISE_NO_EVERYONE
+            elif giveable_role.is_default():  # Same goes for role to be given.
+                notice = self.AUTHORISE_NOT_DEFAULT
+            # Hierarchical role order check.
+            elif authorised_role >= author_max_role and ctx.author != gld.owner:
+                notice = self.AUTHORISE_NO_HIGHER
+            # Check if "pair" already exists.
+            elif authorised_id in auth_list:
+                notice = self.AUTHORISE_EXISTS
+            else:  # Role authorisation is valid.
+                auth_list.append(authorised_id)
+                await auth_value.set(auth_list)
+                self.invalidate_closure(gld.id)
+                notice = self.AUTHORISE_SUCCESS.format(authorised_role.name, giveable_role.name)
         await ctx.send(notice)
 
     @commands.guild_only()
@@ -110,28 +192,33 @@ class AssignRoles(commands.Cog):
          (except for the owner).
         """
         gld = ctx.guild
-        server_dict = await self.config.guild(gld).roles()
-
         author_max_role = max(r for r in ctx.author.roles)
         authorised_id = authorised_role.id
-        giveable_id = giveable_role.id
-
-        if authorised_role.is_default():  # Role to be de-authorised should not be @everyone.
-            notice = self.AUTHORISE_NO_EVERYONE
-        elif giveable_role.is_default():  # Same goes for role to be given.
-            notice = self.AUTHORISE_NOT_DEFAULT
-        elif (
-            authorised_role >= author_max_role and ctx.author != gld.owner
-        ):  # Hierarchical role order check.
-            notice = self.AUTHORISE_NO_HIGHER
-        elif giveable_id not in server_dict:
-            notice = self.AUTHORISE_EMPTY.format(giveable_role.name)
-        elif authorised_id not in server_dict[giveable_id]:
-            notice = self.AUTHORISE_MISMATCH.format(authorised_role.name, giveable_role.name)
-        else:  # Role de-authorisation is valid.
-            server_dict[giveable_id].remove(authorised_id)
-            await self.config.guild(gld).roles.set(server_dict)
-            notice = self.DEAUTHORISE_SUCCESS.format(authorised_role.name, giveable_role.name)
+        auth_entry = self.config.custom(self.AUTH_GROUP, gld.id, giveable_role.id)
+        auth_value = auth_entry.authorised
+
+        async with auth_value.get_lock():  # Only locks this giveable role's entry.
+            auth_list = await auth_value()
+            if authorised_role.is_default():  # Role to be de-authorised should not be @everyone.
+                notice = self.AUTHORISE_NO_EVERYONE
+            elif giveable_role.is_default():  # Same goes for role to be given.
+                notice = self.AUTHORISE_NOT_DEFAULT
+            elif (
+                authorised_role >= author_max_role and ctx.author != gld.owner
+            ):  # Hierarchical role order check.
+                notice = self.AUTHORISE_NO_HIGHER
+            elif not auth_list:
+                notice = self.AUTHORISE_EMPTY.format(giveable_role.name)
+            elif authorised_id not in auth_list:
+                notice = self.AUTHORISE_MISMATCH.format(authorised_role.name, giveable_role.name)
+            else:  # Role de-authorisation is valid.
+                auth_list.remove(authorised_id)
+                if auth_list:
+                    await auth_value.set(auth_list)
+                else:  # Drop the entry entirely, rather than leaving an empty one behind.
+                    await auth_entry.clear()
+                self.invalidate_closure(gld.id)
+                notice = self.DEAUTHORISE_SUCCESS.format(authorised_role.name, giveable_role.name)
         await ctx.send(notice)
 
     @commands.guild_only()
@@ -140,13 +227,15 @@ class AssignRoles(commands.Cog):
     async def list(self, ctx):
         """Send an embed showing which roles can be given by other roles"""
         gld = ctx.guild
-        server_dict = await self.config.guild(gld).roles()
+        # One bulk read of all entries of this guild: {giveable role ID: {"authorised": [...]}}
+        guild_auths = await self.config.custom(self.AUTH_GROUP, gld.id).all()
         embed = discord.Embed(colour=0x00D8FF, title="Assign authorisations")
 
-        for role_id, auth_list in server_dict.items():
-            role: discord.Role = discord.utils.get(gld.roles, id=role_id)
+        for role_id, entry in guild_auths.items():
+            role: discord.Role = gld.get_role(int(role_id))
             if role is not None:
-                auth_roles = (discord.utils.get(gld.roles, id=i) for i in auth_list)
+                # Entries are stored without their defaults, and may even be empty.
+                auth_roles = (gld.get_role(i) for i in entry.get("authorised", []))
                 r: discord.Role
                 mentions_str = ", ".join(r.mention for r in auth_roles if r is not None)
                 if len(mentions_str) > 0:  # Prevent empty fields from being sent.
@@ -156,9 +245,300 @@ class AssignRoles(commands.Cog):
         )
         await ctx.send(embed=embed)
 
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    @_assign.command()
+    async def inherit(self, ctx, authorised_role: discord.Role, source_role: discord.Role):
+        """Authorise one role to give every role that another role can give
+
+        Inheritance is transitive: if `source_role` inherits from a third role,
+         `authorised_role` can also give the roles of that third role.
+        In order to add this rule, your highest role must be strictly above the
+         `authorised_role` (except for the owner).
+        """
+        gld = ctx.guild
+        inherit_value = self.config.custom(self.RULE_GROUP, gld.id, authorised_role.id).inherits
+
+        async with inherit_value.get_lock():
+            inherit_list = await inherit_value()
+            rule_error = self.rule_error(ctx, authorised_role)
+            if rule_error:
+                notice = rule_error
+            elif authorised_role == source_role:
+                notice = self.INHERIT_SELF
+            elif source_role.id in inherit_list:
+                notice = self.INHERIT_EXISTS.format(authorised_role.name, source_role.name)
+            else:  # Rule is valid.
+                inherit_list.append(source_role.id)
+                await inherit_value.set(inherit_list)
+                self.invalidate_closure(gld.id)
+                notice = self.INHERIT_SUCCESS.format(authorised_role.name, source_role.name)
+        await ctx.send(notice)
+
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    @_assign.command()
+    async def uninherit(self, ctx, authorised_role: discord.Role, source_role: discord.Role):
+        """Remove an inheritance rule created with `[p]assign inherit`"""
+        gld = ctx.guild
+        inherit_value = self.config.custom(self.RULE_GROUP, gld.id, authorised_role.id).inherits
+
+        async with inherit_value.get_lock():
+            inherit_list = await inherit_value()
+            rule_error = self.rule_error(ctx, authorised_role)
+            if rule_error:
+                notice = rule_error
+            elif source_role.id not in inherit_list:
+                notice = self.INHERIT_MISMATCH.format(authorised_role.name, source_role.name)
+            else:  # Rule removal is valid.
+                inherit_list.remove(source_role.id)
+                await inherit_value.set(inherit_list)
+                self.invalidate_closure(gld.id)
+                notice = self.UNINHERIT_SUCCESS.format(authorised_role.name, source_role.name)
+        await ctx.send(notice)
+
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    @_assign.command(name="range")
+    async def authorise_range(
+        self, ctx, authorised_role: discord.Role, bottom_role: discord.Role, top_role: discord.Role
+    ):
+        """Authorise one role to give every role between two roles in the hierarchy
+
+        Both `bottom_role` and `top_role` are included, and the range follows the role hierarchy,
+         so roles that are moved into (or out of) the range are picked up automatically.
+        In order to add this rule, your highest role must be strictly above the
+         `authorised_role` (except for the owner).
+        """
+        gld = ctx.guild
+        if bottom_role > top_role:  # Allow the bounds in either order.
+            bottom_role, top_role = top_role, bottom_role
+        range_pair = [bottom_role.id, top_role.id]
+        range_value = self.config.custom(self.RULE_GROUP, gld.id, authorised_role.id).ranges
+
+        async with range_value.get_lock():
+            range_list = await range_value()
+            rule_error = self.rule_error(ctx, authorised_role)
+            if rule_error:
+                notice = rule_error
+            elif range_pair in range_list:
+                notice = self.RANGE_EXISTS.format(authorised_role.name)
+            else:  # Rule is valid.
+                range_list.append(range_pair)
+                await range_value.set(range_list)
+                self.invalidate_closure(gld.id)
+                notice = self.RANGE_SUCCESS.format(
+                    authorised_role.name, bottom_role.name, top_role.name
+                )
+        await ctx.send(notice)
+
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    @_assign.command(name="unrange")
+    async def deauthorise_range(
+        self, ctx, authorised_role: discord.Role, bottom_role: discord.Role, top_role: discord.Role
+    ):
+        """Remove a range rule created with `[p]assign range`"""
+        gld = ctx.guild
+        if bottom_role > top_role:
+            bottom_role, top_role = top_role, bottom_role
+        range_pair = [bottom_role.id, top_role.id]
+        range_value = self.config.custom(self.RULE_GROUP, gld.id, authorised_role.id).ranges
+
+        async with range_value.get_lock():
+            range_list = await range_value()
+            rule_error = self.rule_error(ctx, authorised_role)
+            if rule_error:
+                notice = rule_error
+            elif range_pair not in range_list:
+                notice = self.RANGE_MISMATCH.format(authorised_role.name)
+            else:  # Rule removal is valid.
+                range_list.remove(range_pair)
+                await range_value.set(range_list)
+                self.invalidate_closure(gld.id)
+                notice = self.UNRANGE_SUCCESS.format(
+                    authorised_role.name, bottom_role.name, top_role.name
+                )
+        await ctx.send(notice)
+
+    @commands.guild_only()
+    @commands.mod_or_permissions(manage_guild=True)
+    @_assign.command()
+    async def rules(self, ctx):
+        """Send an embed showing the inheritance and range rules"""
+        gld = ctx.guild
+        guild_rules = await self.config.custom(self.RULE_GROUP, gld.id).all()
+        embed = discord.Embed(colour=0x00D8FF, title="Assign rules")
+
+        for role_id, entry in guild_rules.items():
+            role: discord.Role = gld.get_role(int(role_id))
+            if role is not None:
+                rule_lines = [
+                    "Inherits from {}".format(r.mention)
+                    for r in (gld.get_role(i) for i in entry.get("inherits", []))
+                    if r is not None
+                ]
+                for bottom_id, top_id in entry.get("ranges", []):
+                    bottom, top = gld.get_role(bottom_id), gld.get_role(top_id)
+                    if bottom is not None and top is not None:
+                        rule_lines.append("Range {} up to {}".format(bottom.mention, top.mention))
+                if rule_lines:  # Prevent empty fields from being sent.
+                    embed.add_field(name=role.name, value="\n".join(rule_lines))
+        if len(embed.fields) == 0:
+            embed.description = self.RULES_DESC_EMPTY
+        await ctx.send(embed=embed)
+
+    @commands.guild_only()
+    @commands.mod_or_permissions(manage_guild=True)
+    @_assign.group(name="log", invoke_without_command=True)
+    async def _log(self, ctx):
+        """Look up who assigned or removed which roles
+
+        Each subcommand shows the latest entries, newest first."""
+        await ctx.send_help()
+
+    @_log.command(name="user")
+    async def log_user(self, ctx, user: discord.User):
+        """Show the roles that were assigned to or removed from a user"""
+        await self.send_log(ctx, "target", user.id, user.mention)
+
+    @_log.command(name="role")
+    async def log_role(self, ctx, role: discord.Role):
+        """Show who assigned or removed a role, and for whom"""
+        await self.send_log(ctx, "role", role.id, role.mention)
+
+    @_log.command(name="actor")
+    async def log_actor(self, ctx, actor: discord.User):
+        """Show the roles that a user has assigned or removed"""
+        await self.send_log(ctx, "actor", actor.id, actor.mention)
+
     # Utilities
+    async def send_log(self, ctx, kind: str, key: int, subject: str):
+        """Send an embed with the latest audit log entries of a user, role or actor"""
+        total, records = await self.audit_log.query(ctx.guild.id, kind, key, self.LOG_LIMIT)
+        embed = discord.Embed(colour=0x00D8FF, title=self.LOG_TITLE.format(ctx.guild.name))
+        lines = [
+            self.LOG_LINE.format(
+                r.timestamp // 1000,
+                self.user_mention(r.actor_id),
+                "added" if r.added else "removed",
+                "<@&{}>".format(r.role_id),
+                "to" if r.added else "from",
+                self.user_mention(r.target_id),
+            )
+            for r in records
+        ]
+        # Mentions in embeds do not ping anyone.
+        if lines:
+            embed.description = "{}\n\n{}".format(subject, "\n".join(lines))
+        else:
+            embed.description = self.LOG_EMPTY.format(subject)
+        if total > len(records):
+            embed.set_footer(text=self.LOG_FOOTER.format(len(records), total))
+        await ctx.send(embed=embed)
+
+    def user_mention(self, user_id: int) -> str:
+        """Mention a user from the audit log, of which deleted users have been erased"""
+        return "<@{}>".format(user_id) if user_id else self.LOG_DELETED_USER
+
+    def rule_error(self, ctx, authorised_role: discord.Role) -> str | None:
+        """Get the error notice if the author cannot add rules for a role, else None"""
+        author_max_role = max(r for r in ctx.author.roles)
+        if authorised_role.is_default():
+            return self.AUTHORISE_NO_EVERYONE
+        elif authorised_role >= author_max_role and ctx.author != ctx.guild.owner:
+            return self.AUTHORISE_NO_HIGHER
+        return None
+
+    def invalidate_closure(self, guild_id: int):
+        """Drop the cached effective authorisations of a guild"""
+        self.closures.pop(guild_id, None)
+        # Bumping the generation prevents an in-flight computation from caching stale data.
+        self.closure_generations[guild_id] = self.closure_generations.get(guild_id, 0) + 1
+
+    async def effective_authorisations(self, gld: discord.Guild) -> dict[int, frozenset]:
+        """Get the (cached) effective authorisations of a guild
+
+        The mapping goes from a giveable role ID to the IDs of all roles that may give it,
+         with the inheritance and range rules already applied."""
+        closure = self.closures.get(gld.id)
+        if closure is None:
+            generation = self.closure_generations.get(gld.id, 0)
+            closure = await self.compute_closure(gld)
+            if self.closure_generations.get(gld.id, 0) == generation:
+                self.closures[gld.id] = closure
+        return closure
+
+    async def compute_closure(self, gld: discord.Guild) -> dict[int, frozenset]:
+        """Compute the effective authorisations of a guild from the pairs and rules"""
+        guild_auths = await self.config.custom(self.AUTH_GROUP, gld.id).all()
+        guild_rules = await self.config.custom(self.RULE_GROUP, gld.id).all()
+
+        # Stored entries lack the registered defaults (e.g. a rule with only inherits), hence get.
+        # Roles that each role may give on its own: {authorised ID: {giveable IDs}}
+        direct = defaultdict(set)
+        for giveable_id, entry in guild_auths.items():
+            for authorised_id in entry.get("authorised", []):
+                direct[authorised_id].add(int(giveable_id))
+        inherits = {}
+        for authorised_id, entry in guild_rules.items():
+            authorised_id = int(authorised_id)
+            inherits[authorised_id] = entry.get("inherits", [])
+            for bottom_id, top_id in entry.get("ranges", []):
+                direct[authorised_id].update(self.roles_in_range(gld, bottom_id, top_id))
+
+        # Walk the inheritance graph once per role; the seen set also guards against cycles.
+        givers = defaultdict(set)
+        for authorised_id in direct.keys() | inherits.keys():
+            seen = {authorised_id}
+            stack = [authorised_id]
+            while stack:
+                current = stack.pop()
+                for giveable_id in direct.get(current, ()):
+                    givers[giveable_id].add(authorised_id)
+                for source_id in inherits.get(current, ()):
+                    if source_id not in seen:
+                        seen.add(source_id)
+                        stack.append(source_id)
+        return {giveable_id: frozenset(ids) for giveable_id, ids in givers.items()}
+
+    @staticmethod
+    def roles_in_range(gld: discord.Guild, bottom_id: int, top_id: int) -> list[int]:
+        """Get the IDs of the giveable roles between two roles (inclusive)
+
+        Returns an empty list if either of the roles no longer exists."""
+        bottom, top = gld.get_role(bottom_id), gld.get_role(top_id)
+        if bottom is None or top is None:
+            return []
+        return [
+            r.id
+            for r in gld.roles
+            if bottom.position <= r.position <= top.position
+            and not r.is_default()
+            and not r.managed
+        ]
 
     # Config
-    async def red_delete_data_for_user(self, *, _requester, _user_id):
-        """Do nothing, as no user data is stored."""
-        pass
+    async def migrate_roles_to_custom(self):
+        """Move the legacy per-guild `roles` dicts to one custom group entry per giveable role
+
+        Each guild is written with a single bulk set, after which its legacy dict is cleared."""
+        for guild_id, guild_data in (await self.config.all_guilds()).items():
+            legacy_roles = guild_data.get("roles")
+            if legacy_roles:
+                # JSON storage turns the role ID keys into strings, hence the int conversions.
+                guild_auths = {
+                    str(int(giveable_id)): {"authorised": [int(i) for i in auth_list]}
+                    for giveable_id, auth_list in legacy_roles.items()
+                    if auth_list
+                }
+                await self.config.custom(self.AUTH_GROUP, guild_id).set(guild_auths)
+                await self.config.guild_from_id(guild_id).roles.clear()
+        await self.config.schema_version.set(self.SCHEMA_VERSION)
+
+    async def red_delete_data_for_user(self, *, requester: str, user_id: int):
+        """Erase deleted Discord accounts from the audit log
+
+        Other requests are ignored, as the audit log is kept for moderation purposes."""
+        if requester == "discord_deleted_user":
+            await self.audit_log.delete_user(user_id)
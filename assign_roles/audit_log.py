@@ -0,0 +1,183 @@
+from __future__ import annotations
+# Default Library.
+import array
+import asyncio
+import collections
+import logging
+import os
+import struct
+from typing import Dict, List, NamedTuple, Optional
+
+
+class AuditRecord(NamedTuple):
+    timestamp: int  # UNIX time in milliseconds.
+    actor_id: int
+    target_id: int
+    role_id: int
+    added: bool
+
+
+class AuditLog:
+    """Append-only log of role assignments, one folder per guild
+
+    Every record has a fixed size, so record n starts at byte n * RECORD.size of `log.bin`.
+    For each kind of key (the target, role and actor ID), the index consists of BUCKETS files
+     of (key, record number) pairs. A lookup thus only reads one bucket file, plus the records
+     that it points to. Records are buffered in memory, and written in batches by a
+     background task."""
+
+    RECORD = struct.Struct("<qQQQ?")
+    ID_OFFSETS = {"actor": 8, "target": 16}  # The byte offsets of the user IDs in a record.
+    LOG_NAME = "log.bin"
+    INDEX_NAME = "{}_{}.idx"  # Kind, bucket.
+    KINDS = ("target", "role", "actor")
+    BUCKETS = 64
+    FLUSH_INTERVAL = 5  # In seconds.
+    FLUSH_SIZE = 256  # Buffered records that trigger a flush before the interval has passed.
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.log = logging.getLogger("red.hash_cogs.assign_roles")
+        self.buffer: Dict[int, List[AuditRecord]] = collections.defaultdict(list)
+        self.buffered = 0
+        self.flush_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.writer_loop())
+
+    async def close(self):
+        """Stop the writer once it has written the remaining records"""
+        self.closing = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+        else:
+            await self.flush()
+
+    def append(self, guild_id: int, record: AuditRecord):
+        self.buffer[guild_id].append(record)
+        self.buffered += 1
+        if self.buffered >= self.FLUSH_SIZE:
+            self.wakeup.set()
+
+    async def writer_loop(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+        await self.flush()  # Records appended while the last flush was running.
+
+    async def flush(self):
+        """Write all buffered records to disk"""
+        async with self.flush_lock:
+            await self.write_buffer()
+
+    async def write_buffer(self):
+        """Write all buffered records to disk; the caller must hold the flush lock"""
+        buffer, self.buffer = self.buffer, collections.defaultdict(list)
+        self.buffered = 0
+        loop = asyncio.get_running_loop()
+        for guild_id, records in buffer.items():
+            try:
+                await loop.run_in_executor(None, self.write_records, guild_id, records)
+            except OSError:
+                self.log.exception(f"Could not write the audit log of {guild_id}.")
+
+    # File handling (blocking, run in an executor).
+    def guild_folder(self, guild_id: int) -> str:
+        return os.path.join(self.folder, str(guild_id))
+
+    def bucket(self, key: int) -> int:
+        return (key >> 22) % self.BUCKETS  # The millisecond bits of a snowflake.
+
+    def write_records(self, guild_id: int, records: List[AuditRecord]):
+        folder = self.guild_folder(guild_id)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, self.LOG_NAME), "ab") as log_f:
+            # A partially written record (e.g. after a crash) is overwritten by the next one.
+            first_n = log_f.seek(0, os.SEEK_END) // self.RECORD.size
+            log_f.seek(first_n * self.RECORD.size)
+            log_f.truncate()
+            log_f.write(b"".join(self.RECORD.pack(*r) for r in records))
+
+        entries = collections.defaultdict(lambda: array.array("Q"))
+        for record_n, record in enumerate(records, start=first_n):
+            for kind, key in zip(self.KINDS, (record.target_id, record.role_id, record.actor_id)):
+                entries[(kind, self.bucket(key))].extend((key, record_n))
+        for (kind, bucket), pairs in entries.items():
+            with open(os.path.join(folder, self.INDEX_NAME.format(kind, bucket)), "ab") as idx_f:
+                pairs.tofile(idx_f)
+
+    def read_records(self, guild_id: int, kind: str, key: int, limit: int):
+        """Get the amount of records of a key, and its latest records (newest first)"""
+        folder = self.guild_folder(guild_id)
+        pairs = array.array("Q")
+        idx_fp = os.path.join(folder, self.INDEX_NAME.format(kind, self.bucket(key)))
+        try:
+            with open(idx_fp, "rb") as idx_f:
+                data = idx_f.read()
+        except FileNotFoundError:
+            return 0, []
+        pairs.frombytes(data[: len(data) - len(data) % 16])
+        record_ns = [pairs[i + 1] for i in range(0, len(pairs), 2) if pairs[i] == key]
+        records = []
+        with open(os.path.join(folder, self.LOG_NAME), "rb") as log_f:
+            for record_n in reversed(record_ns[-limit:]):
+                log_f.seek(record_n * self.RECORD.size)
+                records.append(AuditRecord(*self.RECORD.unpack(log_f.read(self.RECORD.size))))
+        return len(record_ns), records
+
+    def erase_user(self, user_id: int):
+        """Replace a user ID by 0 in every record of every guild, and drop its index entries"""
+        if not os.path.isdir(self.folder):
+            return
+        for guild_entry in os.scandir(self.folder):
+            if not guild_entry.is_dir():
+                continue
+            for kind, offset in self.ID_OFFSETS.items():
+                idx_name = self.INDEX_NAME.format(kind, self.bucket(user_id))
+                idx_fp = os.path.join(guild_entry.path, idx_name)
+                if not os.path.isfile(idx_fp):
+                    continue
+                with open(idx_fp, "rb") as idx_f:
+                    data = idx_f.read()
+                pairs, kept = array.array("Q"), array.array("Q")
+                pairs.frombytes(data[: len(data) - len(data) % 16])
+                record_ns = []
+                for i in range(0, len(pairs), 2):
+                    if pairs[i] == user_id:
+                        record_ns.append(pairs[i + 1])
+                    else:
+                        kept.extend((pairs[i], pairs[i + 1]))
+                if not record_ns:
+                    continue
+                # The records are changed first, such that an interrupted erase can be redone.
+                with open(os.path.join(guild_entry.path, self.LOG_NAME), "r+b") as log_f:
+                    for record_n in record_ns:
+                        log_f.seek(record_n * self.RECORD.size + offset)
+                        log_f.write(bytes(8))
+                tmp_fp = idx_fp + ".tmp"
+                with open(tmp_fp, "wb") as idx_f:
+                    kept.tofile(idx_f)
+                os.replace(tmp_fp, idx_fp)
+
+    async def delete_user(self, user_id: int):
+        """Erase a user from the audit logs of all guilds, including the buffered records"""
+        async with self.flush_lock:  # No records are written while the files are rewritten.
+            await self.write_buffer()
+            await asyncio.get_running_loop().run_in_executor(None, self.erase_user, user_id)
+
+    async def query(self, guild_id: int, kind: str, key: int, limit: int):
+        """Get the amount of records of a key, and its latest records (newest first)
+
+        kind is one of KINDS. Buffered records are written first, so they are included."""
+        await self.flush()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.read_records, guild_id, kind, key, limit
+        )
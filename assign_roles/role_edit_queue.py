@@ -0,0 +1,122 @@
+from __future__ import annotations
+# Default Library.
+import asyncio
+from typing import Dict, Set, Tuple
+
+# Required by Red.
+import discord
+
+
+class PendingEdit:
+    """The role changes of one member that are waiting for the end of their window"""
+
+    __slots__ = ("member", "changes", "future")
+
+    def __init__(self, member: discord.Member):
+        self.member = member
+        self.changes: Dict[int, Tuple[discord.Role, bool]] = {}  # Role ID: (role, has role).
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class RoleEditQueue:
+    """Merges rapid role toggles of a member into a single member edit
+
+    A toggle is decided on the state that the member will have once the pending changes are
+     applied, so two toggles of the same role cancel out instead of racing on a stale state.
+    At the end of the window, a net change of one role is sent with add_roles or remove_roles,
+     which cannot undo changes of others that are not in the member cache yet. Only a net change
+     of several roles is sent as one edit(roles=...) call. Nothing is sent if the toggles cancel
+     out.
+    The edits of a member are applied in order, and each edit starts from the changes of the
+     previous one, as the member cache is only updated once Discord sends the member update."""
+
+    WINDOW = 0.5  # In seconds.
+
+    def __init__(self):
+        self.pending: Dict[Tuple[int, int], PendingEdit] = {}  # Keys: (guild ID, member ID).
+        self.sent: Dict[Tuple[int, int], PendingEdit] = {}  # Edits that are (being) applied.
+        self.tasks: Set[asyncio.Task] = set()
+
+    def stop(self):
+        """Cancel the pending edits"""
+        for task in self.tasks:
+            task.cancel()
+        for edit in self.pending.values():
+            edit.future.cancel()
+        self.pending.clear()
+        self.sent.clear()
+
+    def toggle(self, member: discord.Member, role: discord.Role) -> Tuple[bool, asyncio.Future]:
+        """Queue a toggle of a role, and get whether it adds the role, and the edit's future
+
+        The future gives the role IDs of the member once the edit is done, and the IDs of the
+         roles that the edit actually added or removed, or raises the exception of the edit if
+         it failed."""
+        key = (member.guild.id, member.id)
+        edit = self.pending.get(key)
+        if edit is None:
+            edit = self.pending[key] = PendingEdit(member)
+            task = asyncio.create_task(self.apply(key))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        previous = self.sent.get(key)
+        if role.id in edit.changes:
+            has_role = edit.changes[role.id][1]
+        elif previous is not None and role.id in previous.changes:
+            has_role = previous.changes[role.id][1]
+        else:
+            has_role = role in member.roles
+        edit.changes[role.id] = (role, not has_role)
+        return not has_role, edit.future
+
+    async def apply(self, key: Tuple[int, int]):
+        await asyncio.sleep(self.WINDOW)
+        edit = self.pending.pop(key)
+        previous = self.sent.get(key)
+        self.sent[key] = edit
+        if previous is not None:
+            await asyncio.wait([previous.future])
+        # Use the latest cached state, in case the roles were changed elsewhere in the meantime.
+        member = edit.member.guild.get_member(edit.member.id) or edit.member
+        roles: Dict[int, discord.Role] = {r.id: r for r in member.roles if not r.is_default()}
+        if previous is not None and not previous.future.cancelled():
+            if previous.future.exception() is None:  # Possibly not in the member cache yet.
+                self.apply_changes(roles, previous.changes)
+        before = set(roles)
+        self.apply_changes(roles, edit.changes)
+        added = [roles[role_id] for role_id in roles.keys() - before]
+        removed = [edit.changes[role_id][0] for role_id in before - roles.keys()]
+        changed = frozenset(r.id for r in added + removed)
+        try:
+            if len(added) + len(removed) > 1:
+                await member.edit(roles=list(roles.values()))
+            elif added:
+                await member.add_roles(*added)
+            elif removed:
+                await member.remove_roles(*removed)
+        except asyncio.CancelledError:
+            edit.future.cancel()
+            raise
+        except Exception as e:
+            if not edit.future.done():
+                edit.future.set_exception(e)
+        else:
+            if not edit.future.done():
+                edit.future.set_result((frozenset(roles), changed))
+        finally:
+            # Keep the changes around until the member update has most likely arrived.
+            asyncio.get_running_loop().call_later(self.WINDOW, self.forget, key, edit)
+
+    @staticmethod
+    def apply_changes(
+        roles: Dict[int, discord.Role], changes: Dict[int, Tuple[discord.Role, bool]]
+    ):
+        for role_id, (role, has_role) in changes.items():
+            if has_role:
+                roles[role_id] = role
+            else:
+                roles.pop(role_id, None)
+
+    def forget(self, key: Tuple[int, int], edit: PendingEdit):
+        if self.sent.get(key) is edit:
+            del self.sent[key]
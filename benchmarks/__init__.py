@@ -0,0 +1,5 @@
+"""Offline benchmarks of the commands that scale with the size of a guild
+
+The commands run end to end against synthetic guilds (see fakes.generate_guild),
+ with Config kept in memory and all messages and API calls recorded instead of sent.
+Run `python -m benchmarks --help` from the root of the repository for the options."""
@@ -0,0 +1,63 @@
+"""Run the benchmarks, and write the report as json
+
+Usage (from the root of the repository):
+    python -m benchmarks --members 1000 10000 --roles 50 --output report.json
+"""
+# Default Library.
+import argparse
+import json
+import sys
+
+# Local.
+from .runner import CASES, GuildShape, run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description=__doc__.split("\n")[0]
+    )
+    parser.add_argument("--members", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--roles", type=int, default=50)
+    parser.add_argument("--roles-per-member", type=float, default=2.0)
+    parser.add_argument(
+        "--skew", type=float, default=1.0, help="Zipf exponent of role popularity, 0 is uniform"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--uncached",
+        action="store_true",
+        help="Mark the guilds as not chunked, such that the cogs fetch the members in batches",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--rest-latency", type=float, default=0.0, help="Seconds that each fake API call takes"
+    )
+    parser.add_argument(
+        "--case", action="append", choices=[c.name for c in CASES], help="Only run these cases"
+    )
+    parser.add_argument("--output", help="File to write the report to, instead of stdout")
+    args = parser.parse_args(argv)
+
+    shapes = [
+        GuildShape(
+            n, args.roles, args.roles_per_member, args.skew, args.seed, not args.uncached
+        )
+        for n in args.members
+    ]
+    report = run(
+        shapes,
+        args.case,
+        args.repeat,
+        args.rest_latency,
+        progress=lambda msg: print(msg, file=sys.stderr),
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_f:
+            json.dump(report, report_f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
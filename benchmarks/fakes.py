@@ -0,0 +1,251 @@
+from __future__ import annotations
+# Default Library.
+import asyncio
+import collections
+import datetime
+import random
+from typing import Iterable
+
+# Required by Red.
+import discord
+
+DISCORD_EPOCH = 1420070400000  # In milliseconds.
+ONE_DAY_MS = 86_400_000
+GENERATED_UNTIL_MS = 1704067200000  # 2024-01-01, a fixed "now" keeps the generated guilds equal.
+
+
+def snowflake_at(timestamp_ms: int, counter: int = 0) -> int:
+    """Create a snowflake ID for a UNIX timestamp in milliseconds"""
+    return ((timestamp_ms - DISCORD_EPOCH) << 22) | (counter & 0x3FFFFF)
+
+
+def snowflake_time(snowflake: int) -> datetime.datetime:
+    timestamp = ((snowflake >> 22) + DISCORD_EPOCH) / 1000
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+
+class FakeREST:
+    """Counts the calls that would have been made to the Discord API, per route
+
+    Each call waits for `latency` seconds (or just yields to the event loop)."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+
+    async def request(self, route: str):
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+
+
+class FakeRole:
+    __slots__ = ("id", "name", "position", "guild", "managed", "colour")
+
+    def __init__(self, guild: FakeGuild, role_id: int, name: str, position: int):
+        self.guild = guild
+        self.id = role_id
+        self.name = name
+        self.position = position
+        self.managed = False
+        self.colour = discord.Colour.default()
+
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+
+    @property
+    def members(self) -> list[FakeMember]:
+        # Like discord.py, this scans all members of the guild.
+        if self.is_default():
+            return list(self.guild.members)
+        return [m for m in self.guild.members if self in m.roles]
+
+    def is_default(self) -> bool:
+        return self.id == self.guild.id
+
+    def __lt__(self, other: FakeRole) -> bool:
+        return (self.position, self.id) < (other.position, other.id)
+
+    def __le__(self, other: FakeRole) -> bool:
+        return (self.position, self.id) <= (other.position, other.id)
+
+    def __gt__(self, other: FakeRole) -> bool:
+        return (self.position, self.id) > (other.position, other.id)
+
+    def __ge__(self, other: FakeRole) -> bool:
+        return (self.position, self.id) >= (other.position, other.id)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeMember:
+    __slots__ = ("id", "name", "discriminator", "guild", "roles", "joined_at", "bot")
+
+    def __init__(self, guild: FakeGuild, member_id: int, joined_at: datetime.datetime):
+        self.guild = guild
+        self.id = member_id
+        self.name = f"member{member_id % 100_000}"
+        self.discriminator = f"{member_id % 10_000:04d}"
+        self.joined_at = joined_at
+        self.roles: list[FakeRole] = [guild.default_role]
+        self.bot = False
+
+    @property
+    def created_at(self) -> datetime.datetime:
+        return snowflake_time(self.id)
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    @property
+    def display_name(self) -> str:
+        return self.name
+
+    @property
+    def top_role(self) -> FakeRole:
+        return max(self.roles)
+
+    async def add_roles(self, *roles: FakeRole, reason: str = None, atomic: bool = True):
+        for role in roles:
+            await self.guild.rest.request("PUT /guilds/members/roles")
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles: FakeRole, reason: str = None, atomic: bool = True):
+        for role in roles:
+            await self.guild.rest.request("DELETE /guilds/members/roles")
+            if role in self.roles:
+                self.roles.remove(role)
+
+    async def edit(self, *, roles: Iterable[FakeRole] = None, reason: str = None):
+        await self.guild.rest.request("PATCH /guilds/members")
+        if roles is not None:
+            self.roles = [self.guild.default_role, *(r for r in roles if not r.is_default())]
+
+    def __str__(self) -> str:
+        return f"{self.name}#{self.discriminator}"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: str, rest: FakeREST):
+        self.id = guild_id
+        self.name = name
+        self.rest = rest
+        self.filesize_limit = 25 * 1024 * 1024
+        self.chunked = True  # If False, the cogs should use fetch_members instead of members.
+        self.default_role = FakeRole(self, guild_id, "@everyone", 0)
+        self.roles: list[FakeRole] = [self.default_role]  # Sorted on position, like discord.py.
+        self.members: list[FakeMember] = []
+        self.owner: FakeMember | None = None
+        self._roles: dict[int, FakeRole] = {guild_id: self.default_role}
+        self._members: dict[int, FakeMember] = {}
+
+    @property
+    def member_count(self) -> int:
+        return len(self.members)
+
+    def get_role(self, role_id: int) -> FakeRole | None:
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id: int) -> FakeMember | None:
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id: int):
+        return None
+
+    async def fetch_members(self, *, limit: int = 1000, after=None):
+        """Yield the members like the paginated API, which returns up to 1000 members per call"""
+        members = self.members if limit is None else self.members[:limit]
+        for start in range(0, len(members), 1000):
+            await self.rest.request("GET /guilds/members")
+            for member in members[start : start + 1000]:
+                yield member
+
+    def add_role(self, role: FakeRole):
+        self.roles.append(role)
+        self._roles[role.id] = role
+
+    def add_member(self, member: FakeMember):
+        self.members.append(member)
+        self._members[member.id] = member
+
+
+class FakeBot:
+    """Bot without a gateway connection, which never gets ready
+
+    The background tasks that cogs start once the bot is ready thus stay idle."""
+
+    def __init__(self, *guilds: FakeGuild):
+        self.guilds = {g.id: g for g in guilds}
+
+    def get_guild(self, guild_id: int) -> FakeGuild | None:
+        return self.guilds.get(guild_id)
+
+    async def wait_until_red_ready(self):
+        await asyncio.Event().wait()
+
+
+class FakeContext:
+    """Context that records what a command sends, instead of sending it"""
+
+    def __init__(self, guild: FakeGuild, author: FakeMember):
+        self.guild = guild
+        self.author = author
+        self.channel = None
+        self.message = None
+        self.sent: list[dict] = []
+
+    async def send(self, content: str = None, **kwargs):
+        await self.guild.rest.request("POST /channels/messages")
+        kwargs.pop("view", None)  # Keep no references to the menus.
+        self.sent.append(dict(kwargs, content=content))
+
+    async def reply(self, content: str = None, **kwargs):
+        await self.send(content, **kwargs)
+
+    async def tick(self, *, message: str = None) -> bool:
+        await self.guild.rest.request("PUT /channels/messages/reactions")
+        return True
+
+
+def generate_guild(
+    members: int,
+    roles: int,
+    roles_per_member: float = 2.0,
+    skew: float = 1.0,
+    *,
+    seed: int = 0,
+    rest: FakeREST = None,
+) -> FakeGuild:
+    """Generate a guild with synthetic members and roles
+
+    Every member gets on average `roles_per_member` roles. The role popularity follows a Zipf-like
+     distribution: the k-th role is picked with a weight of 1 / k^skew, so 0 is uniform.
+    The same arguments always give the same guild."""
+    rng = random.Random(seed)
+    now_ms = GENERATED_UNTIL_MS
+    guild_created_ms = now_ms - 5 * 365 * ONE_DAY_MS
+    guild_id = snowflake_at(guild_created_ms)
+    guild = FakeGuild(guild_id, f"Benchmark guild {members}", rest or FakeREST())
+
+    for position in range(1, roles + 1):
+        role_id = snowflake_at(guild_created_ms + position * 1000)
+        guild.add_role(FakeRole(guild, role_id, f"role {position}", position))
+    giveable = guild.roles[1:]
+    weights = [1 / (k**skew) for k in range(1, len(giveable) + 1)]
+    rng.shuffle(giveable)  # Such that popularity does not follow the hierarchy.
+
+    for i in range(members):
+        created_ms = rng.randrange(DISCORD_EPOCH, now_ms - ONE_DAY_MS)
+        joined_ms = rng.randrange(max(created_ms, guild_created_ms), now_ms)
+        joined_at = datetime.datetime.fromtimestamp(joined_ms / 1000, tz=datetime.timezone.utc)
+        member = FakeMember(guild, snowflake_at(created_ms, i), joined_at)
+        if giveable:
+            role_n = min(len(giveable), int(rng.expovariate(1 / roles_per_member)))
+            picked = {id(r): r for r in rng.choices(giveable, weights, k=role_n)}
+            member.roles.extend(sorted(picked.values()))
+        guild.add_member(member)
+    guild.owner = guild.members[0] if guild.members else None
+    return guild
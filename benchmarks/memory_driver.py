@@ -0,0 +1,95 @@
+from __future__ import annotations
+# Default Library.
+import contextlib
+import json
+import pickle
+import tempfile
+from typing import Any, AsyncIterator, Dict, Tuple
+
+# Required by Red.
+from redbot.core import config, data_manager
+from redbot.core._drivers import BaseDriver, IdentifierData
+
+
+class MemoryDriver(BaseDriver):
+    """Config driver that keeps all data in memory
+
+    It copies values the same way as Red's JSON driver, so Config has the same per-call cost,
+     except for the writes to disk."""
+
+    # Per cog name: {identifier: data}, shared by the drivers of a cog (like the JSON driver).
+    datastore: Dict[str, dict] = {}
+
+    def __init__(self, cog_name: str, identifier: str, **kwargs):
+        super().__init__(cog_name, identifier)
+        self.data = self.datastore.setdefault(cog_name, {})
+
+    @classmethod
+    async def initialize(cls, **storage_details) -> None:
+        return
+
+    @classmethod
+    async def teardown(cls) -> None:
+        cls.datastore.clear()
+
+    @staticmethod
+    def get_config_details() -> Dict[str, Any]:
+        return {}
+
+    async def get(self, identifier_data: IdentifierData):
+        partial = self.data
+        for i in identifier_data.to_tuple()[1:]:
+            partial = partial[i]
+        return pickle.loads(pickle.dumps(partial, -1))
+
+    async def set(self, identifier_data: IdentifierData, value=None):
+        partial = self.data
+        *parents, last = identifier_data.to_tuple()[1:]
+        for i in parents:
+            partial = partial.setdefault(i, {})
+        partial[last] = json.loads(json.dumps(value))
+
+    async def clear(self, identifier_data: IdentifierData):
+        partial = self.data
+        *parents, last = identifier_data.to_tuple()[1:]
+        try:
+            for i in parents:
+                partial = partial[i]
+            del partial[last]
+        except KeyError:
+            pass
+
+    @classmethod
+    async def aiter_cogs(cls) -> AsyncIterator[Tuple[str, str]]:
+        for cog_name, data in cls.datastore.items():
+            for identifier in data:
+                yield cog_name, identifier
+
+
+def get_memory_driver(cog_name: str, identifier: str, *args, **kwargs) -> MemoryDriver:
+    return MemoryDriver(cog_name, identifier)
+
+
+@contextlib.contextmanager
+def offline_red():
+    """Let cogs use Config and their data folder without a bot or data directory
+
+    Config is backed by memory, and the data folders are put in a temporary directory,
+     which is removed afterwards."""
+    old_basic_config = data_manager.basic_config
+    old_get_driver = config.get_driver
+    with tempfile.TemporaryDirectory(prefix="hashcogs_bench_") as data_path:
+        data_manager.basic_config = {
+            "DATA_PATH": data_path,
+            "COG_PATH_APPEND": "cogs",
+            "CORE_PATH_APPEND": "core",
+            "STORAGE_TYPE": "JSON",
+            "STORAGE_DETAILS": {},
+        }
+        config.get_driver = get_memory_driver
+        try:
+            yield data_path
+        finally:
+            config.get_driver = old_get_driver
+            data_manager.basic_config = old_basic_config
+            MemoryDriver.datastore.clear()
@@ -0,0 +1,190 @@
+from __future__ import annotations
+# Default Library.
+import asyncio
+import datetime
+import platform
+import statistics
+import time
+import tracemalloc
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+# Required by Red.
+import discord
+import redbot
+from redbot.core import commands
+
+# Local.
+from assign_roles.assign_roles import AssignRoles
+from member_stats.member_stats import MemberStats
+from welcome_moderation.welcome_moderation import WelcomeModeration
+from .fakes import FakeBot, FakeContext, FakeGuild, FakeREST, generate_guild
+from .memory_driver import offline_red
+
+REPORT_VERSION = 1
+
+
+class GuildShape(NamedTuple):
+    """The parameters of generate_guild"""
+
+    members: int
+    roles: int
+    roles_per_member: float = 2.0
+    skew: float = 1.0
+    seed: int = 0
+    chunked: bool = True  # Whether the members are cached.
+
+
+class Case(NamedTuple):
+    """A command to benchmark, with how to prepare its cog for a guild"""
+
+    name: str
+    cog_class: type
+    invoke: Callable[[commands.Cog, FakeContext], Awaitable]
+    seed: Optional[Callable[[commands.Cog, FakeGuild], Awaitable]] = None
+
+
+# Seeding
+async def seed_welcome_moderation(cog: WelcomeModeration, gld: FakeGuild):
+    """Use the most popular role as verified role, and ignore the two roles after it"""
+    by_population = sorted(gld.roles[1:], key=lambda r: len(r.members), reverse=True)
+    if by_population:
+        await cog.config.guild(gld).verified_role_id.set(by_population[0].id)
+        await cog.config.guild(gld).ignored_roles.set([r.id for r in by_population[1:3]])
+
+
+async def seed_assign_roles(cog: AssignRoles, gld: FakeGuild):
+    """Authorise each of the top quarter of the roles to give a few of the roles below it"""
+    giveable = gld.roles[1:]
+    staff = giveable[-max(1, len(giveable) // 4) :]
+    guild_auths = {}
+    for i, role in enumerate(giveable[: -len(staff)]):
+        guild_auths[str(role.id)] = {
+            "authorised": [staff[j % len(staff)].id for j in range(i, i + 3)]
+        }
+    await cog.config.custom(cog.AUTH_GROUP, gld.id).set(guild_auths)
+
+
+# The command callbacks are called directly, which skips the checks and argument conversion.
+CASES = (
+    Case(
+        "member_stats.member_csv",
+        MemberStats,
+        lambda cog, ctx: cog.member_csv.callback(cog, ctx),
+    ),
+    Case(
+        "member_stats.role_stats",
+        MemberStats,
+        lambda cog, ctx: cog.role_population_embed.callback(cog, ctx),
+    ),
+    Case(
+        "member_stats.role_overlap",
+        MemberStats,
+        lambda cog, ctx: cog.role_overlap.callback(cog, ctx),
+    ),
+    Case(
+        "welcome_moderation.unverified",
+        WelcomeModeration,
+        lambda cog, ctx: cog.unverified.callback(cog, ctx),
+        seed_welcome_moderation,
+    ),
+    Case(
+        "welcome_moderation.verified_all",
+        WelcomeModeration,
+        lambda cog, ctx: cog.verified_all_members.callback(cog, ctx),
+        seed_welcome_moderation,
+    ),
+    Case(
+        "assign_roles.list",
+        AssignRoles,
+        lambda cog, ctx: cog.list.callback(cog, ctx),
+        seed_assign_roles,
+    ),
+)
+
+
+# Running
+async def run_once(case: Case, shape: GuildShape, rest_latency: float, trace_memory: bool):
+    """Run a case once on a fresh guild and cog, and measure only the command itself"""
+    gld = generate_guild(
+        shape.members,
+        shape.roles,
+        shape.roles_per_member,
+        shape.skew,
+        seed=shape.seed,
+        rest=FakeREST(rest_latency),
+    )
+    gld.chunked = shape.chunked
+    with offline_red():
+        cog = case.cog_class(FakeBot(gld))
+        await cog.cog_load()
+        if case.seed is not None:
+            await case.seed(cog, gld)
+        ctx = FakeContext(gld, gld.owner)
+        gld.rest.calls.clear()
+
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        await case.invoke(cog, ctx)
+        duration = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        await cog.cog_unload()
+    return duration, peak, len(ctx.sent), dict(gld.rest.calls)
+
+
+async def run_case(case: Case, shape: GuildShape, repeat: int, rest_latency: float) -> dict:
+    """Time a case `repeat` times, and measure its peak memory in one additional traced run
+
+    The traced run is separate, as tracemalloc slows down the code it traces."""
+    times = []
+    for _ in range(repeat):
+        duration, _peak, sent, rest_calls = await run_once(case, shape, rest_latency, False)
+        times.append(duration)
+    _duration, peak, _sent, _rest_calls = await run_once(case, shape, rest_latency, True)
+    return {
+        "case": case.name,
+        "guild": shape._asdict(),
+        "times_s": times,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        "peak_memory_bytes": peak,
+        "messages_sent": sent,
+        "rest_calls": rest_calls,
+    }
+
+
+async def run_benchmarks(
+    shapes: list[GuildShape],
+    case_names: list[str] = None,
+    repeat: int = 3,
+    rest_latency: float = 0.0,
+    progress: Callable[[str], None] = None,
+) -> dict:
+    """Run the (selected) cases on every guild shape, and build the report"""
+    cases = [c for c in CASES if not case_names or c.name in case_names]
+    results = []
+    for shape in shapes:
+        for case in cases:
+            if progress is not None:
+                progress(f"{case.name} with {shape.members} members and {shape.roles} roles")
+            results.append(await run_case(case, shape, repeat, rest_latency))
+    return {
+        "report_version": REPORT_VERSION,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "red": redbot.__version__,
+            "discord.py": discord.__version__,
+        },
+        "parameters": {"repeat": repeat, "rest_latency_s": rest_latency},
+        "results": results,
+    }
+
+
+def run(*args, **kwargs) -> dict:
+    return asyncio.run(run_benchmarks(*args, **kwargs))
@@ -1,17 +1,61 @@
 from __future__ import annotations
 # Default Library.
+import asyncio
+import bisect
+import contextlib
 import datetime as dt
+import heapq
+import json
+import logging
+import os.path
+import time
 
 # Required by Red.
 import discord
-from redbot.core import commands
+from redbot.core import commands, Config, data_manager
 from redbot.core.bot import Red
-from redbot.core.utils.chat_formatting import humanize_timedelta
+from redbot.core.utils.chat_formatting import humanize_list, humanize_timedelta
 
 
 SLOWMODE_TIMEDELTA_CONVERTER = commands.TimedeltaConverter(
     minimum=dt.timedelta(seconds=0), maximum=dt.timedelta(hours=6), default_unit="seconds"
 )
+EXPIRY_TIMEDELTA_CONVERTER = commands.TimedeltaConverter(
+    minimum=dt.timedelta(minutes=1), maximum=dt.timedelta(days=7), default_unit="minutes"
+)
+
+
+class MessageRateWindow:
+    """Count messages over a sliding window, using a fixed amount of buckets
+
+    Memory usage is constant, regardless of how active a channel is."""
+
+    __slots__ = ("window_seconds", "bucket_seconds", "counts", "current_bucket")
+
+    def __init__(self, window_seconds: float, bucket_count: int):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = window_seconds / bucket_count
+        self.counts = [0] * bucket_count
+        self.current_bucket = 0  # Absolute bucket number, i.e. time divided by bucket size.
+
+    def advance(self, now: float):
+        """Move the window forward to now, clearing the buckets that fell out of it"""
+        bucket = int(now // self.bucket_seconds)
+        bucket_count = len(self.counts)
+        last_cleared = min(bucket, self.current_bucket + bucket_count)
+        for i in range(self.current_bucket + 1, last_cleared + 1):
+            self.counts[i % bucket_count] = 0
+        self.current_bucket = max(bucket, self.current_bucket)
+
+    def add(self, now: float):
+        """Count one message"""
+        self.advance(now)
+        self.counts[self.current_bucket % len(self.counts)] += 1
+
+    def per_minute(self, now: float) -> float:
+        """Get the message rate over the window, in messages per minute"""
+        self.advance(now)
+        return sum(self.counts) * 60 / self.window_seconds
 
 
 class ChannelSlowmode(commands.Cog):
@@ -23,10 +67,84 @@ class ChannelSlowmode(commands.Cog):
     SLOWMODE_SET = ":white_check_mark: The slowmode in {} has been set to {}."
     SLOWMODE_OFF = ":put_litter_in_its_place: The slowmode in {} has been disabled."
     SLOWMODE_NO_PERMS = X + "I need Manage {} permissions in {} to set a slowmode!"
+    # Bulk slowmode strings.
+    BULK_SET = ":white_check_mark: The slowmode has been set to {} in **{}** channel(s)."
+    BULK_OFF = ":put_litter_in_its_place: The slowmode has been disabled in **{}** channel(s)."
+    BULK_RESTORED = (
+        ":leftwards_arrow_with_hook: The slowmode has been restored in **{}** channel(s)."
+    )
+    BULK_UNCHANGED = "Already at that slowmode: **{}** channel(s)."
+    BULK_NO_PERMS = "Missing permissions in: {}"
+    BULK_FAILED = "Failed due to an API error in: {}"
+    BULK_NO_TARGETS = X + "No text channels or threads were found to change."
+    BULK_NOTHING_SAVED = X + "There are no saved slowmodes to restore."
+    # Automatic slowmode strings.
+    AUTO_SET = (
+        ":white_check_mark: Automatic slowmode enabled in {}. "
+        "The slowmode goes up above **{}** messages per minute."
+    )
+    AUTO_OFF = ":put_litter_in_its_place: Automatic slowmode disabled in {}."
+    # Temporary slowmode strings.
+    TEMP_SET = ":white_check_mark: The slowmode in {} has been set to {}. It will be reverted {}."
+    TEMP_OFF = ":put_litter_in_its_place: The slowmode in {} has been disabled until {}."
+    # Other constants.
+    BULK_CONCURRENCY = 5  # Simultaneous channel edits, well below Discord's global rate limit.
+    AUTO_INTERVAL = 30  # Seconds; this also limits the edits to one per channel per interval.
+    AUTO_WINDOW_SECONDS = 60
+    AUTO_BUCKETS = 12
+    AUTO_LOWER_RATIO = 1 / 3  # Hysteresis: only step down once the rate is well below threshold.
+    AUTO_STEPS = tuple(
+        s
+        for s in (0, 5, 10, 15, 30, 60, 120, 300, 600, 900)
+        if SLOWMODE_TIMEDELTA_CONVERTER.minimum
+        <= dt.timedelta(seconds=s)
+        <= SLOWMODE_TIMEDELTA_CONVERTER.maximum
+    )
+    TIMERS_NAME = "slowmode_timers.json"
+    TIMER_BATCH_SECONDS = 1  # Reverts due within this many seconds of each other are batched.
 
     def __init__(self, bot: Red):
         super().__init__()
         self.bot = bot
+        self.log = logging.getLogger("red.hash_cogs.channel_slowmode")
+        self.config = Config.get_conf(self, identifier=191020268059, force_registration=True)
+        # Slowmodes from before the first bulk change: {channel ID: seconds}
+        self.config.register_guild(bulk_previous={})
+        # Messages per minute above which the automatic slowmode steps up.
+        self.config.register_channel(auto_threshold=None)
+        self.auto_thresholds: dict[int, int] = {}
+        self.auto_windows: dict[int, MessageRateWindow] = {}
+        self.auto_task: asyncio.Task | None = None
+        # Pending reverts: {channel ID: (due UNIX time, slowmode to revert to)}.
+        # The heap holds (due, channel ID) pairs; pairs no longer matching the dict are stale.
+        self.FOLDER = str(data_manager.cog_data_path(self))
+        self.TIMERS_FP = os.path.join(self.FOLDER, self.TIMERS_NAME)
+        self.slowmode_timers: dict[int, tuple[float, int]] = {}
+        self.timer_heap: list[tuple[float, int]] = []
+        self.timer_wakeup = asyncio.Event()
+        self.timer_task: asyncio.Task | None = None
+
+    async def cog_load(self):
+        """Load the automatic slowmodes and pending reverts, and start their tasks"""
+        for channel_id, channel_data in (await self.config.all_channels()).items():
+            if channel_data["auto_threshold"]:
+                self.start_tracking(channel_id, channel_data["auto_threshold"])
+        self.load_timers()
+        self.auto_task = asyncio.create_task(self.auto_slowmode_loop())
+        self.timer_task = asyncio.create_task(self.timer_loop())
+
+    async def cog_unload(self):
+        for task in (self.auto_task, self.timer_task):
+            if task is not None:
+                task.cancel()
+
+    # Events
+    @commands.Cog.listener()
+    async def on_message(self, msg: discord.Message):
+        """Count messages in channels with automatic slowmode"""
+        window = self.auto_windows.get(msg.channel.id)
+        if window is not None and not msg.author.bot:
+            window.add(time.monotonic())
 
     # Commands
     @commands.command()
@@ -51,12 +169,307 @@ class ChannelSlowmode(commands.Cog):
             perm_needed = "Channel" if isinstance(channel, discord.TextChannel) else "Thread"
             notice = self.SLOWMODE_NO_PERMS.format(perm_needed, mention)
         else:
+            self.cancel_revert(channel.id)  # A manual change overrides a temporary slowmode.
             if seconds == 0:
                 notice = self.SLOWMODE_OFF.format(mention)
             else:
                 notice = self.SLOWMODE_SET.format(mention, humanize_timedelta(timedelta=time))
         await ctx.reply(notice, mention_author=False)
 
+    @commands.command()
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_channels=True)
+    async def temp_slowmode(
+        self,
+        ctx: commands.Context,
+        channel: discord.TextChannel | discord.Thread,
+        duration: EXPIRY_TIMEDELTA_CONVERTER,
+        *,
+        time: SLOWMODE_TIMEDELTA_CONVERTER = dt.timedelta(seconds=0),
+    ):
+        """Set the Discord slowmode in a channel (or thread) for a limited duration
+
+        Once the duration (at most 7 days) has passed, the previous slowmode is put back.
+        Pending reverts are kept if the bot restarts.
+        Example: `[p]temp_slowmode #general 2h 30s` sets a 30 second slowmode for 2 hours."""
+        seconds = int(time.total_seconds())
+        mention = channel.mention
+        # If a revert is already pending, keep the slowmode from before the first change.
+        revert_seconds = self.slowmode_timers.get(channel.id, (None, channel.slowmode_delay))[1]
+        try:
+            await channel.edit(slowmode_delay=seconds)
+        except discord.Forbidden:  # Manage channel perms required.
+            perm_needed = "Channel" if isinstance(channel, discord.TextChannel) else "Thread"
+            notice = self.SLOWMODE_NO_PERMS.format(perm_needed, mention)
+        else:
+            due = discord.utils.format_dt(
+                self.schedule_revert(channel.id, revert_seconds, duration), "R"
+            )
+            if seconds == 0:
+                notice = self.TEMP_OFF.format(mention, due)
+            else:
+                notice = self.TEMP_SET.format(mention, humanize_timedelta(timedelta=time), due)
+        await ctx.reply(notice, mention_author=False)
+
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_channels=True)
+    async def bulk_slowmode(
+        self,
+        ctx: commands.Context,
+        targets: commands.Greedy[discord.CategoryChannel | discord.TextChannel | discord.Thread],
+        *,
+        time: SLOWMODE_TIMEDELTA_CONVERTER = dt.timedelta(seconds=0),
+    ):
+        """Set the Discord slowmode in several channels at once
+
+        targets can be any mix of categories, channels and threads.
+        A category targets all text channels inside of it.
+        The slowmodes from before the first bulk change are saved,
+         such that they can be put back with `[p]bulk_slowmode restore`."""
+        channels = {}  # Keyed on ID, to remove duplicates.
+        for target in targets:
+            if isinstance(target, discord.CategoryChannel):
+                channels.update((c.id, c) for c in target.text_channels)
+            else:
+                channels[target.id] = target
+        await self.bulk_set_slowmode(ctx, list(channels.values()), time)
+
+    @bulk_slowmode.command(name="all")
+    async def bulk_slowmode_all(
+        self, ctx: commands.Context, *, time: SLOWMODE_TIMEDELTA_CONVERTER
+    ):
+        """Set the Discord slowmode in all text channels and active threads of this server"""
+        gld = ctx.guild
+        await self.bulk_set_slowmode(ctx, [*gld.text_channels, *gld.threads], time)
+
+    @bulk_slowmode.command(name="restore")
+    async def bulk_slowmode_restore(self, ctx: commands.Context):
+        """Put back the slowmodes from before the bulk changes"""
+        gld = ctx.guild
+        async with self.config.guild(gld).bulk_previous() as previous:
+            if not previous:
+                await ctx.reply(self.BULK_NOTHING_SAVED, mention_author=False)
+                return
+            edits = {}  # Channels that were deleted in the meantime are skipped.
+            for channel_id, seconds in previous.items():
+                channel = gld.get_channel_or_thread(int(channel_id))
+                if channel is not None:
+                    edits[channel] = seconds
+            changed, unchanged, forbidden, failed = await self.edit_slowmodes(edits)
+            # Like a manual change, a restored slowmode overrides a temporary slowmode.
+            self.cancel_revert(*(c.id for c in changed + unchanged))
+            # Only keep the channels which could not be restored, such that it can be retried.
+            previous.clear()
+            previous.update((str(c.id), edits[c]) for c in forbidden + failed)
+        notice = self.BULK_RESTORED.format(len(changed))
+        report = self.bulk_report(notice, unchanged, forbidden, failed)
+        await ctx.reply(report, mention_author=False)
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_channels=True)
+    async def auto_slowmode(
+        self,
+        ctx: commands.Context,
+        channel: discord.TextChannel | discord.Thread,
+        messages_per_minute: int = 0,
+    ):
+        """Let the slowmode of a channel (or thread) follow its activity
+
+        If the channel gets more than `messages_per_minute` messages per minute,
+         the slowmode goes up one step. Once it drops below a third of that, it goes down a step.
+        The slowmode of a channel is changed at most once every 30 seconds.
+        If messages_per_minute is 0 (or less), automatic slowmode is disabled for the channel."""
+        if messages_per_minute <= 0:
+            await self.config.channel(channel).auto_threshold.clear()
+            self.auto_thresholds.pop(channel.id, None)
+            self.auto_windows.pop(channel.id, None)
+            notice = self.AUTO_OFF.format(channel.mention)
+        else:
+            await self.config.channel(channel).auto_threshold.set(messages_per_minute)
+            self.start_tracking(channel.id, messages_per_minute)
+            notice = self.AUTO_SET.format(channel.mention, messages_per_minute)
+        await ctx.reply(notice, mention_author=False)
+
+    # Utilities
+    def schedule_revert(
+        self, channel_id: int, revert_seconds: int, duration: dt.timedelta
+    ) -> dt.datetime:
+        """Schedule the slowmode of a channel to be reverted, and return when that happens"""
+        due = time.time() + duration.total_seconds()
+        self.slowmode_timers[channel_id] = (due, revert_seconds)
+        heapq.heappush(self.timer_heap, (due, channel_id))
+        self.save_timers()
+        self.timer_wakeup.set()  # The new revert may be due before the one being waited on.
+        return dt.datetime.fromtimestamp(due, dt.timezone.utc)
+
+    def cancel_revert(self, *channel_ids: int):
+        """Cancel any pending reverts; their heap entries are discarded once they come up"""
+        cancelled = [self.slowmode_timers.pop(c_id, None) for c_id in channel_ids]
+        if any(timer is not None for timer in cancelled):
+            self.save_timers()
+
+    def load_timers(self):
+        """Load the pending reverts from the data folder"""
+        if os.path.isfile(self.TIMERS_FP):
+            with open(self.TIMERS_FP, encoding="utf-8") as timers_f:
+                raw_timers = json.load(timers_f)
+            self.slowmode_timers = {int(k): (due, rev) for k, (due, rev) in raw_timers.items()}
+            self.timer_heap = [(due, c_id) for c_id, (due, _) in self.slowmode_timers.items()]
+            heapq.heapify(self.timer_heap)
+
+    def save_timers(self):
+        """Save the pending reverts to the data folder, atomically"""
+        tmp_fp = self.TIMERS_FP + ".tmp"
+        with open(tmp_fp, "w", encoding="utf-8") as timers_f:
+            json.dump({str(k): list(v) for k, v in self.slowmode_timers.items()}, timers_f)
+        os.replace(tmp_fp, self.TIMERS_FP)
+
+    async def timer_loop(self):
+        """Sleep until the earliest revert is due (or a new one is scheduled), then run it"""
+        await self.bot.wait_until_red_ready()
+        while True:
+            self.timer_wakeup.clear()
+            delay = self.timer_heap[0][0] - time.time() if self.timer_heap else None
+            if delay is None or delay > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.timer_wakeup.wait(), timeout=delay)
+                continue
+            try:
+                await self.run_due_reverts()
+            except Exception:  # The loop should survive anything.
+                self.log.exception("Error while reverting temporary slowmodes.")
+
+    async def run_due_reverts(self):
+        """Revert all slowmodes that are (nearly) due, in one concurrent batch"""
+        batch_end = time.time() + self.TIMER_BATCH_SECONDS
+        edits = {}
+        while self.timer_heap and self.timer_heap[0][0] <= batch_end:
+            due, channel_id = heapq.heappop(self.timer_heap)
+            timer = self.slowmode_timers.get(channel_id)
+            if timer is None or timer[0] != due:  # Stale: cancelled or rescheduled.
+                continue
+            del self.slowmode_timers[channel_id]
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                edits[channel] = timer[1]
+        self.save_timers()
+        if edits:
+            _, _, forbidden, failed = await self.edit_slowmodes(edits)
+            for channel in forbidden + failed:
+                self.log.warning(f"Could not revert the slowmode in channel {channel.id}.")
+
+    def start_tracking(self, channel_id: int, threshold: int):
+        """Track the message rate of a channel, keeping the current window if there is one"""
+        self.auto_thresholds[channel_id] = threshold
+        if channel_id not in self.auto_windows:
+            window = MessageRateWindow(self.AUTO_WINDOW_SECONDS, self.AUTO_BUCKETS)
+            window.advance(time.monotonic())
+            self.auto_windows[channel_id] = window
+
+    async def auto_slowmode_loop(self):
+        """Periodically evaluate all channels with automatic slowmode"""
+        await self.bot.wait_until_red_ready()
+        while True:
+            await asyncio.sleep(self.AUTO_INTERVAL)
+            try:
+                await self.auto_slowmode_step()
+            except Exception:  # The loop should survive anything.
+                self.log.exception("Error while evaluating the automatic slowmodes.")
+
+    async def auto_slowmode_step(self):
+        """Step the slowmode up or down in each tracked channel with a changed rate"""
+        now = time.monotonic()
+        edits = {}
+        for channel_id, window in self.auto_windows.items():
+            channel = self.bot.get_channel(channel_id)  # Also resolves threads.
+            if channel is not None:
+                current = channel.slowmode_delay
+                rate = window.per_minute(now)
+                target = self.next_auto_step(current, rate, self.auto_thresholds[channel_id])
+                if target != current:
+                    edits[channel] = target
+        if edits:
+            await self.edit_slowmodes(edits)
+
+    def next_auto_step(self, current: int, rate: float, threshold: int) -> int:
+        """Get the slowmode (in seconds) that a channel should have for its message rate"""
+        steps = self.AUTO_STEPS
+        index = max(bisect.bisect_right(steps, current) - 1, 0)  # Highest step not above current.
+        if rate > threshold and index < len(steps) - 1:
+            return steps[index + 1]
+        elif rate < threshold * self.AUTO_LOWER_RATIO and current > steps[0]:
+            # A slowmode between two steps (e.g. set by hand) snaps down to the step below it.
+            return steps[index - 1] if current == steps[index] else steps[index]
+        return current
+
+    async def bulk_set_slowmode(
+        self,
+        ctx: commands.Context,
+        channels: list[discord.TextChannel | discord.Thread],
+        time: dt.timedelta,
+    ):
+        """Set the slowmode of multiple channels, save their old values and report the result"""
+        if not channels:
+            await ctx.reply(self.BULK_NO_TARGETS, mention_author=False)
+            return
+        seconds = int(time.total_seconds())
+        async with self.config.guild(ctx.guild).bulk_previous() as previous:
+            for channel in channels:  # Keep the oldest value if a channel is changed repeatedly.
+                previous.setdefault(str(channel.id), channel.slowmode_delay)
+            changed, unchanged, forbidden, failed = await self.edit_slowmodes(
+                {c: seconds for c in channels}
+            )
+            # Like a manual change, a bulk change overrides a temporary slowmode.
+            self.cancel_revert(*(c.id for c in changed + unchanged))
+            for channel in forbidden + failed:  # Nothing to restore for these channels.
+                if previous.get(str(channel.id)) == channel.slowmode_delay:
+                    del previous[str(channel.id)]
+        if seconds == 0:
+            notice = self.BULK_OFF.format(len(changed))
+        else:
+            notice = self.BULK_SET.format(humanize_timedelta(timedelta=time), len(changed))
+        report = self.bulk_report(notice, unchanged, forbidden, failed)
+        await ctx.reply(report, mention_author=False)
+
+    async def edit_slowmodes(
+        self, edits: dict[discord.TextChannel | discord.Thread, int]
+    ) -> tuple[list, list, list, list]:
+        """Edit the slowmode of channels concurrently, with a cap on simultaneous API calls
+
+        Returns the channels that were changed, unchanged, forbidden and failed, respectively."""
+        semaphore = asyncio.Semaphore(self.BULK_CONCURRENCY)
+        changed, unchanged, forbidden, failed = [], [], [], []
+
+        async def edit_one(channel: discord.TextChannel | discord.Thread, seconds: int):
+            if channel.slowmode_delay == seconds:  # Save an API call.
+                unchanged.append(channel)
+                return
+            async with semaphore:
+                try:
+                    await channel.edit(slowmode_delay=seconds)
+                except discord.Forbidden:
+                    forbidden.append(channel)
+                except discord.HTTPException:
+                    failed.append(channel)
+                else:
+                    changed.append(channel)
+
+        await asyncio.gather(*(edit_one(c, s) for c, s in edits.items()))
+        return changed, unchanged, forbidden, failed
+
+    def bulk_report(self, notice: str, unchanged: list, forbidden: list, failed: list) -> str:
+        """Combine the results of a bulk edit into a single message"""
+        lines = [notice]
+        if unchanged:
+            lines.append(self.BULK_UNCHANGED.format(len(unchanged)))
+        if forbidden:
+            lines.append(self.BULK_NO_PERMS.format(humanize_list([c.mention for c in forbidden])))
+        if failed:
+            lines.append(self.BULK_FAILED.format(humanize_list([c.mention for c in failed])))
+        return "\n".join(lines)
+
     # Config.
     async def red_delete_data_for_user(self, *, _requester, _user_id):
         """Do nothing, as no user data is stored."""
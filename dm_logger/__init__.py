@@ -7,7 +7,8 @@ __red_end_user_data_statement__ = (
     "If you have more questions about what is logged, please contact the bot owner for "
     "clarification.\nNote that due to the security reasons behind logging, "
     "users cannot delete or review the data that is logged."
-    "Therefore, deletion/inspection requests much go through the bot owner."
+    "Therefore, deletion/inspection requests much go through the bot owner.\n"
+    "If the bot owner enables it, the attachments of DMs are also stored on the bot's host."
 )
 
 
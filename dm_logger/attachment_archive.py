@@ -0,0 +1,164 @@
+# Default Library.
+import asyncio
+import collections
+import hashlib
+import logging
+import os
+import posixpath
+import tempfile
+import urllib.parse
+from typing import List, Optional, Tuple
+
+# Used by Red.
+import aiohttp
+
+
+class AttachmentArchive:
+    """Downloads attachments into a folder, stored once per SHA-256 hash of their content
+
+    Downloads are done by a fixed amount of workers that take URLs from a bounded queue;
+     if the queue is full, attachments are not archived rather than piling up during spam.
+    The total size of the archive is capped, and the least recently stored (or re-sent) files
+     are evicted first. The URLs are plain strings, so any HTTP server can be used."""
+
+    WORKERS = 3
+    QUEUE_SIZE = 100
+    CHUNK_SIZE = 64 * 1024
+    TIMEOUT = 60  # In seconds, per download.
+    TMP_SUFFIX = ".part"
+
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.log = logging.getLogger("red.hash_cogs.dm_logger")
+        # Hash: (file name, size), with the least recently used file first.
+        self.files: collections.OrderedDict = collections.OrderedDict()
+        self.total_bytes = 0
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    def load(self):
+        """Read the archived files from the folder, using their modification time as last use"""
+        os.makedirs(self.folder, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(self.TMP_SUFFIX):  # Left behind by an interrupted download.
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, file_name, size in sorted(entries):
+            self.files[file_name.partition(".")[0]] = (file_name, size)
+            self.total_bytes += size
+
+    def start(self, session: aiohttp.ClientSession = None):
+        self.load()
+        timeout = aiohttp.ClientTimeout(total=self.TIMEOUT)
+        self.session = session or aiohttp.ClientSession(timeout=timeout)
+        self.queue = asyncio.Queue(self.QUEUE_SIZE)
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.WORKERS)]
+
+    async def close(self):
+        for task in self.workers:
+            task.cancel()
+        while self.queue is not None and not self.queue.empty():
+            self.queue.get_nowait()[-1].cancel()
+        if self.session is not None:
+            await self.session.close()
+
+    def submit(self, url: str, size: int = 0) -> Optional[asyncio.Future]:
+        """Queue the download of an attachment, and get a future of its hash
+
+        The future gives None if the download failed. Nothing is queued (and None is returned)
+         if the attachment is larger than the archive, or if the queue is full."""
+        if size > self.max_bytes:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((url, future))
+        except asyncio.QueueFull:
+            return None
+        return future
+
+    async def worker(self):
+        while True:
+            url, future = await self.queue.get()
+            try:
+                digest = await self.download(url)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                self.log.warning(f"Could not archive the attachment {url}: {e}")
+                digest = None
+            except Exception:  # Keep the worker alive, and never leave a future pending.
+                self.log.exception(f"Could not archive the attachment {url}.")
+                digest = None
+            if not future.done():
+                future.set_result(digest)
+
+    async def download(self, url: str) -> str:
+        """Download a file into the archive, and get its hash"""
+        hasher = hashlib.sha256()
+        size = 0
+        tmp_fd, tmp_fp = tempfile.mkstemp(suffix=self.TMP_SUFFIX, dir=self.folder)
+        try:
+            with os.fdopen(tmp_fd, "wb") as tmp_f:
+                async with self.session.get(url) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise ValueError("the file is larger than the archive")
+                        hasher.update(chunk)
+                        tmp_f.write(chunk)
+            digest = hasher.hexdigest()
+            if digest in self.files and self.touch(digest):
+                os.remove(tmp_fp)  # Already archived, so only marked as recently used.
+            else:  # New, or its file was removed by hand and the download takes its place.
+                file_name = digest + self.extension(url)
+                os.replace(tmp_fp, os.path.join(self.folder, file_name))
+                self.files[digest] = (file_name, size)
+                self.total_bytes += size
+                self.evict()
+        except BaseException:
+            if os.path.exists(tmp_fp):
+                os.remove(tmp_fp)
+            raise
+        return digest
+
+    def touch(self, digest: str) -> bool:
+        """Mark an archived file as recently used, and get whether its file still exists"""
+        self.files.move_to_end(digest)
+        try:
+            os.utime(self.path(digest))
+        except FileNotFoundError:  # Removed by hand.
+            self.total_bytes -= self.files.pop(digest)[1]
+            return False
+        return True
+
+    def evict(self):
+        """Remove the least recently used files until the archive is within its size cap"""
+        while self.total_bytes > self.max_bytes and self.files:
+            file_name, size = self.files.popitem(last=False)[1]
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.folder, file_name))
+            except FileNotFoundError:
+                pass
+
+    def path(self, digest: str) -> Optional[str]:
+        """Get the path of an archived file, or None if it is not (or no longer) archived"""
+        entry = self.files.get(digest)
+        return None if entry is None else os.path.join(self.folder, entry[0])
+
+    def status(self) -> Tuple[int, int, int]:
+        """Get the amount of archived files, their total size and the amount of queued downloads"""
+        return len(self.files), self.total_bytes, self.queue.qsize() if self.queue else 0
+
+    @staticmethod
+    def extension(url: str) -> str:
+        """Get the (sanitised) file extension of a URL, such as ".png", or an empty string"""
+        ext = posixpath.splitext(urllib.parse.urlsplit(url).path)[1].lower()
+        return ext if 1 < len(ext) <= 10 and ext[1:].isalnum() else ""
@@ -1,4 +1,5 @@
 # Default Library.
+import asyncio
 import csv
 import os.path
 
@@ -8,6 +9,8 @@ from redbot.core import commands, Config, data_manager
 from redbot.core.bot import Red
 from redbot.core.commands import Cog, Context
 
+from .attachment_archive import AttachmentArchive
+
 
 class DMLogger(Cog):
     """Log DMs sent to the bot to a csv file
@@ -30,12 +33,21 @@ class DMLogger(Cog):
         "• Manually download the log file, then delete it from the bot, "
         "such that the logs can start fresh."
     )
+    ARCHIVE_STATUS = (
+        ":file_cabinet: Attachment archiving is **{state}**.\n"
+        "**Archived:** {files} files, {size} of {cap}\n**Queued downloads:** {queued}"
+    )
+    ARCHIVE_MISSING = X + "no archived attachment has that hash."
+    ARCHIVE_TOO_BIG = (
+        X + "the attachment is too big to send here!\n\n**Size:** {fs}\n**Limit:** {fl}"
+    )
     # Other constants.
     DELIMITER = ";"
     HEADER_LINE = ("Timestamp", "User ID", "Username", "Message", "Attachments")
     CSV_NAME = "dm_logs.csv"
     ONE_MB = 1024 * 1024  # From bytes to MB.
     EIGHT_MB = ONE_MB * 8
+    ARCHIVE_FOLDER = "attachments"
 
     def __init__(self, bot: Red):
         super().__init__()
@@ -43,7 +55,20 @@ class DMLogger(Cog):
         self.config = Config.get_conf(self, identifier=120420198059)
         self.FOLDER = str(data_manager.cog_data_path(self))
         self.CSV_FP = os.path.join(self.FOLDER, self.CSV_NAME)
-        self.config.register_global(msgs_since_export=0, periodic_log_threshold=None)
+        self.config.register_global(
+            msgs_since_export=0,
+            periodic_log_threshold=None,
+            archive_attachments=False,
+            archive_max_mb=500,
+        )
+        self.archive = AttachmentArchive(os.path.join(self.FOLDER, self.ARCHIVE_FOLDER), 0)
+
+    async def cog_load(self):
+        self.archive.max_bytes = await self.config.archive_max_mb() * self.ONE_MB
+        self.archive.start()
+
+    async def cog_unload(self):
+        await self.archive.close()
 
     # Events
     @Cog.listener()
@@ -57,8 +82,8 @@ class DMLogger(Cog):
             and not await self.bot.is_owner(aut)
             and not aut.bot
         ):
-            # Log DM to CSV file.
-            self.log_dm_to_csv(msg)
+            # Log DM to CSV file, once its attachments are archived (if enabled).
+            self.log_dm_to_csv(msg, await self.archive_attachments(msg))
             # Check if the threshold for the periodical export is met.
             export_count = await self.config.msgs_since_export() + 1
             periodic_threshold = await self.config.periodic_log_threshold()
@@ -91,6 +116,60 @@ class DMLogger(Cog):
         await self.config.periodic_log_threshold.set(to_set)
         await ctx.tick()
 
+    @commands.group(name="dm_archive", invoke_without_command=True)
+    @commands.is_owner()
+    async def dm_archive(self, ctx: Context):
+        """Show the status of the DM attachment archive
+
+        When enabled, attachments of logged DMs are downloaded into the data folder.
+        Identical files are stored only once, under the SHA-256 hash of their content,
+         which is noted after the URL in the DM log."""
+        files, size, queued = self.archive.status()
+        state = "enabled" if await self.config.archive_attachments() else "disabled"
+        await ctx.reply(
+            self.ARCHIVE_STATUS.format(
+                state=state,
+                files=files,
+                size=self.file_size_in_mb(size),
+                cap=self.file_size_in_mb(self.archive.max_bytes),
+                queued=queued,
+            )
+        )
+
+    @dm_archive.command(name="toggle")
+    async def dm_archive_toggle(self, ctx: Context, enabled: bool):
+        """Enable or disable archiving the attachments of logged DMs"""
+        await self.config.archive_attachments.set(enabled)
+        await ctx.tick()
+
+    @dm_archive.command(name="size")
+    async def dm_archive_size(self, ctx: Context, max_size_mb: int):
+        """Set the maximum size of the archive in MB
+
+        Once the archive is full, the least recently received attachments are removed first."""
+        max_size_mb = max(max_size_mb, 1)
+        await self.config.archive_max_mb.set(max_size_mb)
+        self.archive.max_bytes = max_size_mb * self.ONE_MB
+        self.archive.evict()
+        await ctx.tick()
+
+    @dm_archive.command(name="get")
+    @commands.bot_has_permissions(attach_files=True)
+    async def dm_archive_get(self, ctx: Context, sha256: str):
+        """Send an archived attachment, given the hash noted in the DM log"""
+        fp = self.archive.path(sha256.lower())
+        if fp is None or not os.path.isfile(fp):
+            await ctx.reply(self.ARCHIVE_MISSING)
+        else:
+            max_size = self.channel_file_limit(ctx)
+            filesize = os.path.getsize(fp)
+            if filesize > max_size:
+                filesize_mb = self.file_size_in_mb(filesize)
+                max_size_mb = self.file_size_in_mb(max_size)
+                await ctx.reply(self.ARCHIVE_TOO_BIG.format(fs=filesize_mb, fl=max_size_mb))
+            else:
+                await ctx.reply(file=discord.File(fp))
+
     # Command is owner only. If permission granted to non-owner, who then runs this command in DMs,
     #  this will likely result in an error, as the file is updated while a message is being sent.
     @commands.command(name="get_dms")
@@ -116,14 +195,34 @@ class DMLogger(Cog):
                 await self.config.msgs_since_export.set(0)
 
     # Utilities
-    def log_dm_to_csv(self, msg: discord.Message):
-        """Log a csv file to the CSV file"""
+    async def archive_attachments(self, msg: discord.Message) -> dict:
+        """Archive the attachments of a message if enabled, and get their hashes by URL"""
+        if not msg.attachments or not await self.config.archive_attachments():
+            return {}
+        futures = {a.url: self.archive.submit(a.url, a.size) for a in msg.attachments}
+        queued = {url: f for url, f in futures.items() if f is not None}
+        try:
+            digests = await asyncio.gather(*queued.values(), return_exceptions=True)
+        except asyncio.CancelledError:  # Unloaded while downloading; log the URLs only.
+            return {}
+        # Downloads that were cancelled (on unload) or failed are logged with their URL only.
+        return {url: digest for url, digest in zip(queued, digests) if isinstance(digest, str)}
+
+    def log_dm_to_csv(self, msg: discord.Message, archived: dict = None):
+        """Log a DM to the CSV file
+
+        Archived attachments are noted as "URL [sha256:hash]", with archived mapping URLs to
+         the hashes."""
+        archived = archived or {}
         aut = msg.author
-        stamp = str(msg.created_at.utcnow())
+        stamp = str(msg.created_at.replace(tzinfo=None))  # In UTC, without the offset.
         user_id = "ID: {}".format(aut.id)  # "ID:" prevents number truncations.
         username = str(aut)
         content = "Content: {}".format(msg.content)  # "Content:" prevents prefix issues.
-        attach_str = ", ".join(attachment.url for attachment in msg.attachments)
+        attach_str = ", ".join(
+            "{} [sha256:{}]".format(a.url, archived[a.url]) if a.url in archived else a.url
+            for a in msg.attachments
+        )
         with open(self.CSV_FP, mode="a", newline="", errors="ignore", encoding="utf-8") as csv_f:
             csv_w = csv.writer(csv_f, delimiter=self.DELIMITER)
             if csv_f.tell() == 0:  # Empty file, append headers.
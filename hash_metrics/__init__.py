@@ -0,0 +1,8 @@
+from .hash_metrics import HashMetrics
+
+
+__red_end_user_data_statement__ = "No user data is stored by this cog."
+
+
+async def setup(bot):
+    await bot.add_cog(HashMetrics(bot))
@@ -0,0 +1,360 @@
+from __future__ import annotations
+# Default Library.
+import asyncio
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os.path
+import time
+
+# Required by Red.
+from redbot.core import commands, Config, data_manager
+from redbot.core.bot import Red
+from redbot.core.utils.chat_formatting import box, pagify
+
+
+class LatencyHistogram:
+    """Latency histogram with fixed, logarithmic buckets, hence constant memory
+
+    The buckets grow by 25% each, starting at 0.1 ms, so percentiles are within 25% accuracy."""
+
+    BOUNDS = tuple(0.0001 * 1.25**i for i in range(64))  # Upper bounds in seconds, up to ~2.5 min.
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)  # The last bucket catches everything above.
+        self.total = 0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.total += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction: float) -> float:
+        """Get the (upper bound of the bucket of the) latency at a fraction between 0 and 1"""
+        target = fraction * self.total
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+        return 0.0
+
+
+class HandlerStats:
+    """Latency and call counters of a single listener or command"""
+
+    __slots__ = ("latency", "errors", "config_reads", "config_writes", "rest_calls")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.config_reads = 0
+        self.config_writes = 0
+        self.rest_calls = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.latency.total,
+            "errors": self.errors,
+            "p50_ms": round(self.latency.percentile(0.50) * 1000, 2),
+            "p95_ms": round(self.latency.percentile(0.95) * 1000, 2),
+            "p99_ms": round(self.latency.percentile(0.99) * 1000, 2),
+            "max_ms": round(self.latency.max * 1000, 2),
+            "config_reads": self.config_reads,
+            "config_writes": self.config_writes,
+            "rest_calls": self.rest_calls,
+        }
+
+
+# The stats of the handler that is currently running, for attributing Config and REST calls.
+CURRENT_HANDLER: contextvars.ContextVar[HandlerStats | None] = contextvars.ContextVar(
+    "hash_metrics_handler", default=None
+)
+
+
+class HashMetrics(commands.Cog):
+    """Measure the latency, Config usage and API calls of the listeners and commands of HashCogs
+
+    Loading this cog is all it takes; the other cogs do not need to be changed or configured."""
+
+    __author__ = "#s#8059"
+    # Messages.
+    X = ":x: Error: "
+    NO_DATA = "No listeners or commands of HashCogs have been measured yet."
+    DUMP_SET = ":white_check_mark: The metrics will be saved to `{}` every {} minutes."
+    DUMP_OFF = ":put_litter_in_its_place: The periodic metrics dump has been disabled."
+    RESET_DONE = ":put_litter_in_its_place: All metrics have been reset."
+    # Other constants.
+    INSTRUMENTED_COGS = (
+        "AssignRoles",
+        "ChannelSlowmode",
+        "DMLogger",
+        "MemberStats",
+        "SnowflakeTools",
+        "SpotifyNP",
+        "ViewAssets",
+        "WelcomeModeration",
+    )
+    DUMP_NAME = "metrics.json"
+    TABLE_ROW = "{:<44} {:>7} {:>9} {:>9} {:>9} {:>6} {:>6} {:>6}"
+    TABLE_HEADER = TABLE_ROW.format(
+        "Handler", "Calls", "p50 ms", "p95 ms", "p99 ms", "Reads", "Writes", "REST"
+    )
+
+    def __init__(self, bot: Red):
+        super().__init__()
+        self.bot = bot
+        self.log = logging.getLogger("red.hash_cogs.hash_metrics")
+        self.config = Config.get_conf(self, identifier=201020268059, force_registration=True)
+        self.config.register_global(dump_minutes=0)
+        self.FOLDER = str(data_manager.cog_data_path(self))
+        self.DUMP_FP = os.path.join(self.FOLDER, self.DUMP_NAME)
+        self.stats: dict[str, HandlerStats] = {}
+        # Per cog name: the instrumented cog (instance), its (event name, original, wrapper)
+        #  listeners and its instrumented commands.
+        self.instrumented_cogs: dict[str, commands.Cog] = {}
+        self.wrapped_listeners: dict[str, list[tuple[str, object, object]]] = {}
+        self.hooked_commands: dict[str, list[commands.Command]] = {}
+        self.patched_drivers: dict[str, object] = {}
+        self.command_starts: dict[int, tuple[float, contextvars.Token]] = {}
+        self.dump_task: asyncio.Task | None = None
+
+    async def cog_load(self):
+        self.patch_http()
+        for cog_name in self.INSTRUMENTED_COGS:
+            cog = self.bot.get_cog(cog_name)
+            if cog is not None:
+                self.instrument(cog)
+        self.dump_task = asyncio.create_task(self.dump_loop())
+
+    async def cog_unload(self):
+        if self.dump_task is not None:
+            self.dump_task.cancel()
+        for cog_name in list(self.instrumented_cogs):
+            self.uninstrument(cog_name)
+        self.unpatch_http()
+
+    # Events
+    @commands.Cog.listener()
+    async def on_cog_add(self, cog: commands.Cog):
+        if cog.qualified_name in self.INSTRUMENTED_COGS:
+            self.instrument(cog)
+
+    @commands.Cog.listener()
+    async def on_cog_remove(self, cog: commands.Cog):
+        # After a reload, the name may already belong to the new instance, which is kept.
+        if self.instrumented_cogs.get(cog.qualified_name) is cog:
+            self.uninstrument(cog.qualified_name)
+
+    # Commands
+    @commands.group(name="hashmetrics", invoke_without_command=True)
+    @commands.is_owner()
+    async def _hash_metrics(self, ctx: commands.Context):
+        """Show the latency percentiles and call counts per listener and command
+
+        Reads, Writes and REST are totals over all calls of a handler."""
+        if not self.stats:
+            await ctx.send(self.NO_DATA)
+            return
+        rows = [self.TABLE_HEADER]
+        for name, stats in sorted(self.stats.items()):
+            data = stats.to_dict()
+            rows.append(
+                self.TABLE_ROW.format(
+                    name[:44],
+                    data["calls"],
+                    data["p50_ms"],
+                    data["p95_ms"],
+                    data["p99_ms"],
+                    data["config_reads"],
+                    data["config_writes"],
+                    data["rest_calls"],
+                )
+            )
+        for page in pagify("\n".join(rows), page_length=1900):
+            await ctx.send(box(page))
+
+    @_hash_metrics.command(name="dump")
+    async def set_dump_interval(self, ctx: commands.Context, minutes: int):
+        """Periodically save the metrics to a json file in the data folder
+
+        If minutes is 0 (or less), the periodic dump is disabled."""
+        if minutes > 0:
+            await self.config.dump_minutes.set(minutes)
+            to_send = self.DUMP_SET.format(self.DUMP_NAME, minutes)
+        else:
+            await self.config.dump_minutes.clear()
+            to_send = self.DUMP_OFF
+        if self.dump_task is not None:  # Restart, such that the new interval applies now.
+            self.dump_task.cancel()
+        self.dump_task = asyncio.create_task(self.dump_loop())
+        await ctx.send(to_send)
+
+    @_hash_metrics.command(name="reset")
+    async def reset_metrics(self, ctx: commands.Context):
+        """Reset all measurements"""
+        self.stats.clear()
+        await ctx.send(self.RESET_DONE)
+
+    # Utilities
+    def stats_for(self, name: str) -> HandlerStats:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = HandlerStats()
+        return stats
+
+    def instrument(self, cog: commands.Cog):
+        """Wrap the listeners, hook the commands and count the Config calls of a cog"""
+        cog_name = cog.qualified_name
+        if self.instrumented_cogs.get(cog_name) is cog:
+            return
+        if cog_name in self.instrumented_cogs:  # Reloaded, but on_cog_remove has not run yet.
+            self.uninstrument(cog_name)
+        self.instrumented_cogs[cog_name] = cog
+        wrapped = self.wrapped_listeners[cog_name] = []
+        for event_name, listener in cog.get_listeners():
+            wrapper = self.wrap_listener(f"{cog_name}.{listener.__name__}", listener, cog)
+            self.bot.remove_listener(listener, event_name)
+            self.bot.add_listener(wrapper, event_name)
+            wrapped.append((event_name, listener, wrapper))
+
+        hooked = self.hooked_commands[cog_name] = []
+        for command in cog.walk_commands():
+            if command._before_invoke is None and command._after_invoke is None:
+                name = f"{cog_name}.{command.qualified_name}"
+                command.before_invoke(self.make_before_hook(name))
+                command.after_invoke(self.make_after_hook(name))
+                hooked.append(command)
+
+        config = getattr(cog, "config", None)
+        if isinstance(config, Config):
+            self.patch_driver(config._driver)
+            self.patched_drivers[cog_name] = config._driver
+
+    def uninstrument(self, cog_name: str):
+        """Undo everything that instrument did for a cog
+
+        The original listeners are only put back if the instrumented instance is still loaded."""
+        cog = self.instrumented_cogs.pop(cog_name, None)
+        cog_loaded = cog is not None and self.bot.get_cog(cog_name) is cog
+        for event_name, listener, wrapper in self.wrapped_listeners.pop(cog_name, []):
+            self.bot.remove_listener(wrapper, event_name)
+            if cog_loaded:
+                self.bot.add_listener(listener, event_name)
+        for command in self.hooked_commands.pop(cog_name, []):
+            command._before_invoke = None
+            command._after_invoke = None
+        driver = self.patched_drivers.pop(cog_name, None)
+        if driver is not None:
+            for method_name in ("get", "set", "clear"):
+                vars(driver).pop(method_name, None)  # Fall back to the class methods.
+
+    def wrap_listener(self, name: str, listener, cog: commands.Cog):
+        """Wrap a listener, such that it is measured
+
+        Once its cog is removed (before on_cog_remove runs), the wrapper no longer calls it."""
+
+        @functools.wraps(listener)
+        async def wrapper(*args, **kwargs):
+            if self.bot.get_cog(cog.qualified_name) is not cog:
+                return None
+            stats = self.stats_for(name)
+            token = CURRENT_HANDLER.set(stats)
+            start = time.perf_counter()
+            try:
+                return await listener(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.latency.add(time.perf_counter() - start)
+                CURRENT_HANDLER.reset(token)
+
+        return wrapper
+
+    def make_before_hook(self, name: str):
+        # The hook is awaited in the task of the command, so the context variable carries over.
+        async def before_hook(*args):
+            ctx = args[-1]  # Called as (cog, ctx).
+            token = CURRENT_HANDLER.set(self.stats_for(name))
+            self.command_starts[id(ctx)] = (time.perf_counter(), token)
+
+        return before_hook
+
+    def make_after_hook(self, name: str):
+        async def after_hook(*args):
+            ctx = args[-1]
+            start, token = self.command_starts.pop(id(ctx), (None, None))
+            if start is not None:
+                stats = self.stats_for(name)
+                stats.latency.add(time.perf_counter() - start)
+                if ctx.command_failed:
+                    stats.errors += 1
+                CURRENT_HANDLER.reset(token)
+
+        return after_hook
+
+    @staticmethod
+    def patch_driver(driver):
+        """Count the reads and writes of a Config driver for the current handler"""
+
+        def counted(method, attribute: str):
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                stats = CURRENT_HANDLER.get()
+                if stats is not None:
+                    setattr(stats, attribute, getattr(stats, attribute) + 1)
+                return await method(*args, **kwargs)
+
+            return wrapper
+
+        driver.get = counted(driver.get, "config_reads")
+        driver.set = counted(driver.set, "config_writes")
+        driver.clear = counted(driver.clear, "config_writes")
+
+    def patch_http(self):
+        """Count the REST calls made by the current handler"""
+        http = self.bot.http
+        request = http.request
+
+        @functools.wraps(request)
+        async def counted_request(*args, **kwargs):
+            stats = CURRENT_HANDLER.get()
+            if stats is not None:
+                stats.rest_calls += 1
+            return await request(*args, **kwargs)
+
+        http.request = counted_request
+
+    def unpatch_http(self):
+        vars(self.bot.http).pop("request", None)  # Fall back to the class method.
+
+    async def dump_loop(self):
+        """Save the metrics to the data folder at the configured interval"""
+        minutes = await self.config.dump_minutes()
+        while minutes > 0:
+            await asyncio.sleep(minutes * 60)
+            try:
+                self.dump_metrics()
+            except OSError:
+                self.log.exception("Could not save the metrics.")
+
+    def dump_metrics(self):
+        """Save the metrics to a json file in the data folder, atomically"""
+        data = {
+            "timestamp": time.time(),
+            "handlers": {name: stats.to_dict() for name, stats in self.stats.items()},
+        }
+        tmp_fp = self.DUMP_FP + ".tmp"
+        with open(tmp_fp, "w", encoding="utf-8") as dump_f:
+            json.dump(data, dump_f, indent=2)
+        os.replace(tmp_fp, self.DUMP_FP)
+
+    # Config
+    async def red_delete_data_for_user(self, *, _requester, _user_id):
+        """Do nothing, as no user data is stored."""
+        pass
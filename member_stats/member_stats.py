@@ -1,14 +1,24 @@
+from __future__ import annotations
 # Default Library.
 import csv
 import datetime
 import datetime as dt
+import heapq
+import os.path
 import re
+import tempfile
+from typing import AsyncIterator, Iterator
 
 # Required by Red.
 import discord
 from redbot.core import commands, Config, data_manager
 from redbot.core.bot import Red
-from redbot.core.utils.menus import SimpleMenu
+from redbot.core.utils.chat_formatting import box, pagify
+
+# Local.
+from .lazy_menu import LazyMenu
+from .member_table import DAY_US, MemberTable, from_timestamp_us, snowflake_us, timestamp_us
+from .role_overlap import RoleOverlap
 
 
 class MemberStats(commands.Cog):
@@ -22,8 +32,36 @@ class MemberStats(commands.Cog):
     GUILD_NO_ROLES = X + "this server has no roles."
     FILE_MSG = "Here is a csv file with the member list."
     CSV_TOO_BIG = X + "the member csv is too big to send here!\n\n**Size:** {fs}\n**Limit:** {fl}"
+    NEGATIVE_DAYS = X + "the amount of days cannot be negative."
+    NOT_IN_TABLE = X + "{} has no known join date."
+    JOIN_RANK = "**{}** was member **#{}** (out of {}) to join this server."
+    AGE_TITLE = "Account ages of {} members"
+    FRESH_TITLE = "Members that joined within {} days of creating their account"
+    FRESH_DESC = "**{}** out of {} members. The most recent joins are listed below."
+    NO_OVERLAP = "No two roles on this server have members in common."
+    OVERLAP_TITLE = "Roles with the most members in common"
+    OVERLAP_FILE_MSG = "Here is a csv file with the amount of members that each pair of roles has."
+    OVERLAP_TOO_BIG = (
+        X + "the role overlap csv is too big to send here!\n\n**Size:** {fs}\n**Limit:** {fl}"
+    )
 
     # Other constants.
+    MEMBER_BATCH = 1000  # The page size of fetch_members.
+    CSV_RUN_SIZE = 50_000  # Rows that member_csv sorts in memory, before spilling them to disk.
+    # Upper bounds (in days) of the account age histogram, with their labels.
+    AGE_BUCKETS = (
+        (1, "1 day"),
+        (7, "1 week"),
+        (30, "1 month"),
+        (90, "3 months"),
+        (365, "1 year"),
+        (730, "2 years"),
+        (1826, "5 years"),
+    )
+    AGE_ROW = "{:<11} {:>8} {:>6.1%} {}"
+    FRESH_LIST_N = 20
+    OVERLAP_ROW = "{:<20} {:<20} {:>7} {:>6} {:>6}  {}"
+    OVERLAP_NAME_LENGTH = 20
     ROLE_ROW = "`{:0{}d}` {} • **{}**"
     FIELD_N = 10
     ONE_MB = 1024 * 1024  # From bytes to MB.
@@ -43,8 +81,53 @@ class MemberStats(commands.Cog):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=220420188059)
         self.FOLDER = str(data_manager.cog_data_path(self))
+        # Per guild ID, kept up to date by the join/leave events once built.
+        self.member_tables: dict[int, MemberTable] = {}
+        # Per guild ID, dropped whenever a role or the roles of a member change.
+        self.role_overlaps: dict[int, RoleOverlap] = {}
 
     # Events
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        self.role_overlaps.pop(member.guild.id, None)
+        table = self.member_tables.get(member.guild.id)
+        if table is not None:
+            table.add(member)
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        self.role_overlaps.pop(payload.guild_id, None)
+        table = self.member_tables.get(payload.guild_id)
+        if table is not None:
+            table.remove(payload.user.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.member_tables.pop(guild.id, None)
+        self.role_overlaps.pop(guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Joins, leaves and role changes may have been missed.
+        self.member_tables.clear()
+        self.role_overlaps.clear()
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            self.role_overlaps.pop(after.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        self.role_overlaps.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.role_overlaps.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        self.role_overlaps.pop(after.guild.id, None)
 
     # Commands
     @commands.command()
@@ -64,20 +147,34 @@ class MemberStats(commands.Cog):
             file_stamp = dt.datetime.utcnow().strftime("%Y-%m-%d_%H_%M_%S")
 
             csv_name = self.FOLDER + "/{} at {}.csv".format(srv_name, file_stamp)
-            now = dt.datetime.now(datetime.timezone.utc)
-            with open(csv_name, "w", newline="", errors="ignore", encoding="utf-8") as csv_f:
-                csv_w = csv.writer(csv_f, delimiter=delimiter)
-                csv_w.writerow(self.MEMBER_CSV_HEADER)
-                for n, user in enumerate(sorted(gld.members, key=lambda x: x.joined_at)):
-                    username = "{}#{}".format(user.name, user.discriminator)
-                    userid = "ID: {}".format(user.id)  # Excel truncates plain IDs :(
-                    join, born = user.joined_at, user.created_at
-                    join_days, born_days = (now - join).days, (now - born).days
-                    pre_days = (join - born).days
-                    csv_w.writerow(
-                        [n + 1, username, userid, join, born, join_days, born_days, pre_days]
-                    )
-                csv_filesize: int = csv_f.tell()  # In bytes.
+            now = timestamp_us(dt.datetime.now(datetime.timezone.utc))
+            with tempfile.TemporaryDirectory() as run_folder:
+                if gld.chunked:  # The table is in join order already, only names are looked up.
+                    sorted_rows = self.table_rows(gld, await self.member_table(gld))
+                else:
+                    sorted_rows = await self.sorted_member_rows(gld, run_folder)
+
+                with open(csv_name, "w", newline="", errors="ignore", encoding="utf-8") as csv_f:
+                    csv_w = csv.writer(csv_f, delimiter=delimiter)
+                    csv_w.writerow(self.MEMBER_CSV_HEADER)
+                    for n, (join, user_id, username) in enumerate(sorted_rows):
+                        userid = "ID: {}".format(user_id)  # Excel truncates plain IDs :(
+                        born = snowflake_us(user_id)
+                        join_days, born_days = (now - join) // DAY_US, (now - born) // DAY_US
+                        pre_days = (join - born) // DAY_US
+                        csv_w.writerow(
+                            [
+                                n + 1,
+                                username,
+                                userid,
+                                from_timestamp_us(join),
+                                from_timestamp_us(born),
+                                join_days,
+                                born_days,
+                                pre_days,
+                            ]
+                        )
+                    csv_filesize: int = csv_f.tell()  # In bytes.
             size_limit = ctx.guild.filesize_limit
             if csv_filesize > size_limit:
                 fs = self.file_size_in_mb(csv_filesize)
@@ -86,6 +183,135 @@ class MemberStats(commands.Cog):
             else:
                 await ctx.reply(content=self.FILE_MSG, file=discord.File(csv_name))
 
+    @commands.command(name="account_ages")
+    @commands.guild_only()
+    @commands.mod_or_permissions(manage_roles=True)
+    async def account_age_histogram(self, ctx: commands.Context):
+        """Show a histogram of how old the accounts of the members are"""
+        table = await self.member_table(ctx.guild)
+        now = timestamp_us(dt.datetime.now(dt.timezone.utc))
+        counts = table.age_histogram(now, [d * DAY_US for d, _ in self.AGE_BUCKETS])
+        labels = ["< " + label for _, label in self.AGE_BUCKETS]
+        labels.append("≥ " + self.AGE_BUCKETS[-1][1])
+        total = max(len(table), 1)
+        rows = (
+            self.AGE_ROW.format(label, count, count / total, "█" * round(20 * count / total))
+            for label, count in zip(labels, counts)
+        )
+        await ctx.send(
+            "**{}**\n{}".format(self.AGE_TITLE.format(len(table)), box("\n".join(rows)))
+        )
+
+    @commands.command(name="fresh_joins")
+    @commands.guild_only()
+    @commands.mod_or_permissions(manage_roles=True)
+    async def fresh_joins(self, ctx: commands.Context, days: int = 1):
+        """List the members that joined within some days of creating their account
+
+        Such accounts are often alts, or part of a raid. The most recent joins are listed first."""
+        if days < 0:
+            await ctx.send(self.NEGATIVE_DAYS)
+            return
+        table = await self.member_table(ctx.guild)
+        positions = table.joined_within(days * DAY_US)
+        embed = discord.Embed(
+            title=self.FRESH_TITLE.format(days), colour=discord.Colour.blurple()
+        )
+        embed.description = self.FRESH_DESC.format(len(positions), len(table))
+        if positions:
+            embed.add_field(
+                name="Most recent",
+                value="\n".join(
+                    "`#{}` <@{}>".format(i + 1, table.ids[i])
+                    for i in reversed(positions[-self.FRESH_LIST_N :])
+                ),
+            )
+        await ctx.send(embed=embed)
+
+    @commands.command(name="join_rank", aliases=["join_position"])
+    @commands.guild_only()
+    async def join_rank(self, ctx: commands.Context, member: discord.Member = None):
+        """Show as which member someone joined the server
+
+        If no member is provided, your own join position is shown."""
+        member = member or ctx.author
+        table = await self.member_table(ctx.guild)
+        rank = table.rank(member)
+        if rank is None:
+            await ctx.send(self.NOT_IN_TABLE.format(member.display_name))
+        else:
+            await ctx.send(self.JOIN_RANK.format(member.display_name, rank, len(table)))
+
+    @commands.command(name="role_overlap")
+    @commands.guild_only()
+    @commands.mod_or_permissions(manage_roles=True)
+    async def role_overlap(self, ctx: commands.Context, top_n: int = 15):
+        """Show the pairs of roles that have the most members in common
+
+        The percentages are the share of each role's members that also have the other role.
+        A role that is a subset (⊆) of another role may be redundant."""
+        overlap = await self.guild_role_overlap(ctx.guild)
+        top = overlap.top(max(top_n, 1))
+        if not top:
+            await ctx.send(self.NO_OVERLAP)
+            return
+        rows = [self.OVERLAP_ROW.format("Role A", "Role B", "Both", "% A", "% B", "")]
+        for count, i, j in top:
+            role_a, role_b = overlap.roles[i], overlap.roles[j]
+            size_a, size_b = overlap.sizes[i], overlap.sizes[j]
+            if size_a == size_b == count:
+                note = "A = B"
+            elif count == size_a:
+                note = "A ⊆ B"
+            elif count == size_b:
+                note = "B ⊆ A"
+            else:
+                note = ""
+            rows.append(
+                self.OVERLAP_ROW.format(
+                    role_a.name[: self.OVERLAP_NAME_LENGTH],
+                    role_b.name[: self.OVERLAP_NAME_LENGTH],
+                    count,
+                    "{:.0%}".format(count / size_a),
+                    "{:.0%}".format(count / size_b),
+                    note,
+                )
+            )
+        await ctx.send("**{}**".format(self.OVERLAP_TITLE))
+        for page in pagify("\n".join(rows), page_length=1900):
+            await ctx.send(box(page))
+
+    @commands.command(name="role_overlap_csv")
+    @commands.guild_only()
+    @commands.mod_or_permissions(manage_roles=True)
+    @commands.bot_has_permissions(attach_files=True)
+    async def role_overlap_csv(self, ctx: commands.Context, delimiter: str = "\t"):
+        """Export the amount of members that each pair of roles shares to a csv matrix
+
+        The diagonal holds the amount of members of each role.
+        The delimiter must be exactly one character (or undefined), and is a Tab by default."""
+        gld = ctx.guild
+        if len(delimiter) != 1:
+            await ctx.send(self.DELIMITED_TOO_LONG)
+            return
+        overlap = await self.guild_role_overlap(gld)
+        srv_name = re.sub(r"\W+", "", gld.name)
+        file_stamp = dt.datetime.utcnow().strftime("%Y-%m-%d_%H_%M_%S")
+        csv_name = self.FOLDER + "/{} role overlap at {}.csv".format(srv_name, file_stamp)
+        with open(csv_name, "w", newline="", errors="ignore", encoding="utf-8") as csv_f:
+            csv_w = csv.writer(csv_f, delimiter=delimiter)
+            csv_w.writerow(["Role", *(r.name for r in overlap.roles)])
+            for role, row in zip(overlap.roles, overlap.overlaps):
+                csv_w.writerow([role.name, *row])
+            csv_filesize: int = csv_f.tell()  # In bytes.
+        size_limit = gld.filesize_limit
+        if csv_filesize > size_limit:
+            fs = self.file_size_in_mb(csv_filesize)
+            fl = self.file_size_in_mb(size_limit)
+            await ctx.reply(self.OVERLAP_TOO_BIG.format(fs=fs, fl=fl))
+        else:
+            await ctx.reply(content=self.OVERLAP_FILE_MSG, file=discord.File(csv_name))
+
     @commands.command(name="role_stats", aliases=["rolestats"])
     @commands.guild_only()
     async def role_population_embed(self, ctx: commands.Context, hierarchy_sort: bool = None):
@@ -114,9 +340,9 @@ class MemberStats(commands.Cog):
             desc_str = "Total members: **{}**".format(gld.member_count)
             width = len(str(role_count))
             # Split the role list into fields with a maximum of 10 rows.
-            field_list = []
             field_count = ((role_count - 1) // self.FIELD_N) + 1
-            for i in range(field_count):
+
+            def role_field(i: int) -> tuple[str, str]:
                 start = self.FIELD_N * i
                 end = start + self.FIELD_N if role_count > (start + self.FIELD_N) else role_count
                 field_name = "{}-{}".format(start + 1, end)
@@ -126,29 +352,129 @@ class MemberStats(commands.Cog):
                         for i, t in enumerate(sorted_roles[start:end], start=start)
                     )
                 )
-                field_list.append((field_name, field_value))
+                return field_name, field_value
+
             # Check whether all fields can be sent within one embed, or whether a menu is needed.
             if field_count <= 2:  # All fields fit in one embed.
                 embed = discord.Embed(
                     title="Server roles", description=desc_str, colour=discord.Colour.blurple()
                 )
-                for f_name, f_value in field_list:
+                for i in range(field_count):
+                    f_name, f_value = role_field(i)
                     embed.add_field(name=f_name, value=f_value)
                 embed.set_footer(text=embed_footer)
                 await ctx.send(embed=embed)
             else:  # Multiple embeds needed, use pagified menu.
-                embed_list = []
-                for n, (f_name, f_value) in enumerate(field_list, start=1):
+
+                def render_page(i: int) -> discord.Embed:
                     embed = discord.Embed(
                         title="Server roles", description=desc_str, colour=discord.Colour.blurple()
                     )
+                    f_name, f_value = role_field(i)
                     embed.add_field(name=f_name, value=f_value)
-                    footer_page_n = f"{n} of {field_count}. "
+                    footer_page_n = f"{i + 1} of {field_count}. "
                     embed.set_footer(text=footer_page_n + embed_footer)
-                    embed_list.append(embed)
-                await SimpleMenu(embed_list).start(ctx)
+                    return embed
+
+                await LazyMenu(field_count, render_page).start(ctx)
 
     # Utilities.
+    async def member_batches(self, gld: discord.Guild) -> AsyncIterator[list[discord.Member]]:
+        """Yield the members of a guild in lists of at most MEMBER_BATCH members
+
+        If the member cache of the guild is incomplete (e.g. because member caching is disabled),
+         the members are fetched from Discord instead, keeping only one batch in memory."""
+        if gld.chunked:
+            members = gld.members
+            for start in range(0, len(members), self.MEMBER_BATCH):
+                yield members[start : start + self.MEMBER_BATCH]
+        else:
+            batch = []
+            async for member in gld.fetch_members(limit=None):
+                batch.append(member)
+                if len(batch) == self.MEMBER_BATCH:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    async def member_table(self, gld: discord.Guild) -> MemberTable:
+        """Get the member table of a guild, (re)building it if it is missing or out of date
+
+        The table is out of date if its member count no longer follows the one of the guild,
+         e.g. if a join or leave was missed."""
+        table = self.member_tables.get(gld.id)
+        if table is None or table.member_count != gld.member_count:
+            member_count = gld.member_count
+            rows, skipped = [], 0
+            async for batch in self.member_batches(gld):
+                for row in map(MemberTable.row, batch):
+                    if row is None:
+                        skipped += 1
+                    else:
+                        rows.append(row)
+            table = MemberTable.from_rows(rows, member_count, skipped)
+            self.member_tables[gld.id] = table
+        return table
+
+    async def guild_role_overlap(self, gld: discord.Guild) -> RoleOverlap:
+        """Get the (cached) role overlap of a guild, with its roles sorted on hierarchy"""
+        overlap = self.role_overlaps.get(gld.id)
+        if overlap is None:
+            roles = sorted((r for r in gld.roles if not self.ignore_role(r)), reverse=True)
+            overlap = RoleOverlap(roles)
+            async for batch in self.member_batches(gld):
+                overlap.add_members(batch)
+            overlap.compute()
+            self.role_overlaps[gld.id] = overlap
+        return overlap
+
+    @staticmethod
+    def table_rows(gld: discord.Guild, table: MemberTable) -> Iterator[tuple[int, int, str]]:
+        """Get the csv data of the (cached) members in a table, in join order"""
+        for member_id, joined in zip(table.ids, table.joined):
+            user = gld.get_member(member_id)
+            if user is not None:
+                yield joined, member_id, "{}#{}".format(user.name, user.discriminator)
+
+    async def sorted_member_rows(
+        self, gld: discord.Guild, run_folder: str
+    ) -> Iterator[tuple[int, int, str]]:
+        """Get the csv data of all members sorted on join date, without needing a member cache
+
+        The rows are sorted in runs of a bounded size, which are merged from disk if needed."""
+        run_fps, rows = [], []
+        async for batch in self.member_batches(gld):
+            rows.extend(self.member_row(m) for m in batch)
+            if len(rows) >= self.CSV_RUN_SIZE:
+                run_fps.append(self.write_run(run_folder, len(run_fps), rows))
+                rows = []
+        if run_fps:
+            run_fps.append(self.write_run(run_folder, len(run_fps), rows))
+            return heapq.merge(*(self.read_run(fp) for fp in run_fps))
+        return iter(sorted(rows))
+
+    @staticmethod
+    def member_row(user: discord.Member) -> tuple[int, int, str]:
+        """Get the sortable csv data of a member: (join time in microseconds, ID, username)"""
+        username = "{}#{}".format(user.name, user.discriminator)
+        return timestamp_us(user.joined_at), user.id, username
+
+    @staticmethod
+    def write_run(folder: str, run_n: int, rows: list[tuple[int, int, str]]) -> str:
+        """Sort member rows, and write them to a temporary csv file"""
+        run_fp = os.path.join(folder, f"run_{run_n}.csv")
+        with open(run_fp, "w", newline="", encoding="utf-8") as run_f:
+            csv.writer(run_f).writerows(sorted(rows))
+        return run_fp
+
+    @staticmethod
+    def read_run(run_fp: str) -> Iterator[tuple[int, int, str]]:
+        """Lazily read the member rows of a file written by write_run"""
+        with open(run_fp, newline="", encoding="utf-8") as run_f:
+            for join_us, user_id, username in csv.reader(run_f):
+                yield int(join_us), int(user_id), username
+
     @staticmethod
     def ignore_role(role: discord.Role) -> bool:
         """Check whether to ignore a role for the population embed
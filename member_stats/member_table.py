@@ -0,0 +1,126 @@
+from __future__ import annotations
+# Default Library.
+import array
+import bisect
+import datetime as dt
+from typing import Iterable, List, Optional, Tuple
+
+# Required by Red.
+import discord
+
+UNIX_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+ONE_US = dt.timedelta(microseconds=1)
+DAY_US = 86_400_000_000
+DISCORD_EPOCH = 1420070400000  # In milliseconds.
+
+
+def timestamp_us(moment: dt.datetime) -> int:
+    """Get a datetime as (exact) microseconds since the UNIX epoch"""
+    return (moment - UNIX_EPOCH) // ONE_US
+
+
+def from_timestamp_us(timestamp: int) -> dt.datetime:
+    return UNIX_EPOCH + timestamp * ONE_US
+
+
+def snowflake_us(snowflake: int) -> int:
+    """Get the creation time of a snowflake in microseconds since the UNIX epoch"""
+    return ((snowflake >> 22) + DISCORD_EPOCH) * 1000
+
+
+class MemberTable:
+    """The members of a guild in join order, as three columns of 64-bit integers
+
+    The columns are the member IDs, the join timestamps and the account creation timestamps,
+     with the timestamps in microseconds since the UNIX epoch. This takes 24 bytes per member,
+     and queries loop over plain integers instead of member objects and datetimes.
+    Members without a join date are not in the table, but they are counted as skipped, such
+     that member_count follows the member count of the guild that the table was built for."""
+
+    __slots__ = ("ids", "joined", "created", "member_count", "skipped")
+
+    def __init__(self):
+        self.ids = array.array("q")
+        self.joined = array.array("q")
+        self.created = array.array("q")
+        self.member_count = 0
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def row(member: discord.Member) -> Optional[Tuple[int, int]]:
+        """Get the (join timestamp, ID) of a member to build a table with, if it has a join date"""
+        return None if member.joined_at is None else (timestamp_us(member.joined_at), member.id)
+
+    @classmethod
+    def from_rows(
+        cls, rows: List[Tuple[int, int]], member_count: int, skipped: int = 0
+    ) -> MemberTable:
+        """Build a table from (join timestamp, ID) rows, which are sorted in place
+
+        The member count is the one of the guild at the time the rows were gathered."""
+        table = cls()
+        table.member_count = member_count
+        table.skipped = skipped
+        rows.sort()
+        for joined, member_id in rows:
+            table.ids.append(member_id)
+            table.joined.append(joined)
+            table.created.append(snowflake_us(member_id))
+        return table
+
+    def add(self, member: discord.Member):
+        self.member_count += 1
+        if member.joined_at is None:
+            self.skipped += 1
+        else:
+            joined = timestamp_us(member.joined_at)
+            i = bisect.bisect_right(self.joined, joined)  # Normally the end of the table.
+            self.ids.insert(i, member.id)
+            self.joined.insert(i, joined)
+            self.created.insert(i, snowflake_us(member.id))
+
+    def remove(self, member_id: int):
+        self.member_count -= 1
+        try:
+            i = self.ids.index(member_id)
+        except ValueError:  # One of the skipped members.
+            self.skipped = max(self.skipped - 1, 0)
+            return
+        del self.ids[i]
+        del self.joined[i]
+        del self.created[i]
+
+    def rank(self, member: discord.Member) -> Optional[int]:
+        """Get the join position of a member (starting at 1), or None if not in the table"""
+        if member.joined_at is None:
+            return None
+        joined = timestamp_us(member.joined_at)
+        i = bisect.bisect_left(self.joined, joined)
+        while i < len(self) and self.joined[i] == joined:
+            if self.ids[i] == member.id:
+                return i + 1
+            i += 1
+        return None
+
+    def age_histogram(self, now: int, bounds: Iterable[int]) -> List[int]:
+        """Count the accounts per age bucket, given the ascending upper bounds of the ages
+
+        The last count is of the accounts that are older than the last bound."""
+        created = sorted(self.created)
+        counts, previous = [], len(created)
+        for bound in bounds:
+            # The accounts created before now - bound are older than the bound.
+            older = bisect.bisect_left(created, now - bound)
+            counts.append(previous - older)
+            previous = older
+        counts.append(previous)
+        return counts
+
+    def joined_within(self, max_age: int) -> List[int]:
+        """Get the join positions of the members that joined within max_age of account creation"""
+        return [
+            i for i, (j, c) in enumerate(zip(self.joined, self.created)) if j - c <= max_age
+        ]
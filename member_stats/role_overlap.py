@@ -0,0 +1,70 @@
+from __future__ import annotations
+# Default Library.
+import array
+import heapq
+from typing import Iterable, List, Optional, Tuple
+
+# Required by Red.
+import discord
+
+if hasattr(int, "bit_count"):  # Python 3.10+
+    popcount = int.bit_count
+else:
+
+    def popcount(bits: int) -> int:
+        return bin(bits).count("1")
+
+
+class RoleOverlap:
+    """The amount of members that each pair of roles has in common
+
+    Every role gets a bitset over the member indices, built in a bytearray and turned into an int
+     once. Each pairwise count is then a single AND and popcount, instead of a set intersection."""
+
+    __slots__ = ("roles", "index", "bitmaps", "member_n", "sizes", "overlaps")
+
+    def __init__(self, roles: List[discord.Role]):
+        self.roles = roles
+        self.index = {r.id: i for i, r in enumerate(roles)}
+        self.bitmaps: Optional[List[bytearray]] = [bytearray() for _ in roles]
+        self.member_n = 0
+        self.sizes: List[int] = []
+        self.overlaps: List[array.array] = []  # Square matrix, the diagonal holds the sizes.
+
+    def add_members(self, members: Iterable[discord.Member]):
+        """Set the bits of a batch of members; call compute once all members are added"""
+        for member in members:
+            byte, bit = self.member_n >> 3, 1 << (self.member_n & 7)
+            for role in member.roles:
+                role_i = self.index.get(role.id)
+                if role_i is not None:
+                    bitmap = self.bitmaps[role_i]
+                    if len(bitmap) <= byte:
+                        bitmap.extend(bytes(byte + 1 - len(bitmap)))
+                    bitmap[byte] |= bit
+            self.member_n += 1
+
+    def compute(self):
+        bitsets = [int.from_bytes(b, "little") for b in self.bitmaps]
+        self.bitmaps = None
+        self.sizes = [popcount(b) for b in bitsets]
+        role_n = len(bitsets)
+        self.overlaps = [array.array("q", bytes(8 * role_n)) for _ in range(role_n)]
+        for i in range(role_n):
+            self.overlaps[i][i] = self.sizes[i]
+            if self.sizes[i]:
+                for j in range(i + 1, role_n):
+                    if self.sizes[j]:
+                        count = popcount(bitsets[i] & bitsets[j])
+                        self.overlaps[i][j] = self.overlaps[j][i] = count
+
+    def top(self, n: int) -> List[Tuple[int, int, int]]:
+        """Get the n pairs of roles with the most members in common, as (count, i, j)"""
+        role_n = len(self.roles)
+        pairs = (
+            (self.overlaps[i][j], i, j)
+            for i in range(role_n)
+            for j in range(i + 1, role_n)
+            if self.overlaps[i][j]
+        )
+        return heapq.nlargest(n, pairs)
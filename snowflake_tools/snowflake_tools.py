@@ -1,14 +1,75 @@
+from __future__ import annotations
+# Default Library.
+import collections
+import csv
+import datetime as dt
+import io
+import re
+
 # Required by Red.
 import discord
 from redbot.core import commands
 from redbot.core.bot import Red
+from redbot.core.utils.chat_formatting import box
+
+
+class UTCTimeConverter(commands.Converter):
+    """Convert a time to an aware UTC datetime
+
+    Accepted are Discord timestamps (`<t:1700000000:f>`), UNIX timestamps in seconds,
+     ISO times such as `2023-02-19 14:05` (read as UTC), and durations such as `2h30m` (ago)."""
+
+    DISCORD_TIMESTAMP = re.compile(r"<t:(-?\d+)(?::\w)?>")
+
+    async def convert(self, ctx: commands.Context, argument: str) -> dt.datetime:
+        argument = argument.strip()
+        match = self.DISCORD_TIMESTAMP.fullmatch(argument)
+        if match:
+            return dt.datetime.fromtimestamp(int(match[1]), dt.timezone.utc)
+        elif argument.isdigit():
+            return dt.datetime.fromtimestamp(int(argument), dt.timezone.utc)
+        try:
+            parsed = dt.datetime.fromisoformat(argument)
+        except ValueError:
+            pass
+        else:
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=dt.timezone.utc)
+        delta = commands.parse_timedelta(argument)
+        if delta is None:
+            raise commands.BadArgument(f"`{argument}` is not a time that I understand.")
+        return dt.datetime.now(dt.timezone.utc) - delta
 
 
 class SnowflakeTools(commands.Cog):
     """Convert snowflake IDs for various uses"""
 
     __author__ = "#s#8059"
+    X = ":x: Error: "
     GOTO_LINK = "<https://discordapp.com/channels/{gld_id}/{chn_id}/{msg_id}>"
+    BULK_NO_IDS = X + "no snowflake IDs were found in your message or its attachments."
+    BULK_SUMMARY = (
+        "**Snowflakes decoded:** {n}\n**Earliest (UTC):** {first}\n**Latest (UTC):** {last}"
+    )
+    BULK_CLUSTERS = "**Minutes with {}+ snowflakes:**\n{}"
+    BULK_NO_CLUSTERS = "No minute contains {} or more snowflakes."
+    RANGE_MSG = (
+        "**From (UTC):** {start}\n**Until (UTC):** {end}\n"
+        "**Lowest snowflake:** `{low}`\n**Highest snowflake:** `{high}`"
+    )
+    RANGE_REVERSED = X + "the start time must not be after the end time."
+    RANGE_OUT_OF_BOUNDS = X + "snowflakes only exist for times after 2015 and before 2154."
+    GOTO_TIME_FOUND = "First message after {time} UTC: {url}"
+    GOTO_TIME_NONE = "No messages were sent after {time} UTC. The position in chat: {url}"
+    GOTO_TIME_NO_PERMS = X + "I cannot read the message history of {}."
+    # Other constants.
+    DISCORD_EPOCH = 1420070400000  # First second of 2015, in milliseconds.
+    SNOWFLAKE_PATTERN = re.compile(r"\b\d{15,21}\b")
+    BULK_CSV_HEADER = ("Snowflake", "Time (UTC)", "Worker", "Process", "Increment")
+    BULK_TABLE_MAX = 15  # Larger results are sent as a csv file instead.
+    BULK_MAX_ATTACHMENT = 4 * 1024 * 1024  # Bytes.
+    CLUSTER_MIN = 3
+    CLUSTER_SHOWN = 10
+    TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 
     def __init__(self, bot: Red):
         super().__init__()
@@ -33,6 +94,128 @@ class SnowflakeTools(commands.Cog):
         msg = "**Input:** {}\n**Time (UTC):** {}".format(snowflake_id, time_str)
         await ctx.reply(msg, mention_author=False)
 
+    @commands.command(aliases=["timestamps"])
+    async def snowflakes(self, ctx: commands.Context, *, text: str = ""):
+        """Decode many Snowflake IDs at once
+
+        The IDs can be anywhere in the message (mentions work too), or in attached text files.
+        The result is sorted on time, and includes the worker, process and increment fields.
+        Minutes in which many of the snowflakes were created are summarised,
+         which helps to find clusters of accounts created at the same time."""
+        for attachment in ctx.message.attachments:
+            if attachment.size <= self.BULK_MAX_ATTACHMENT:
+                text += "\n" + (await attachment.read()).decode("utf-8", errors="ignore")
+        ids = sorted({int(i) for i in self.SNOWFLAKE_PATTERN.findall(text)})
+        if not ids:
+            await ctx.reply(self.BULK_NO_IDS, mention_author=False)
+            return
+        rows = self.decode_snowflakes(ids)  # Sorted on time, as IDs are sorted on time.
+        summary = self.BULK_SUMMARY.format(
+            n=len(rows), first=self.format_ms(rows[0][1]), last=self.format_ms(rows[-1][1])
+        )
+        minute_counts = collections.Counter(ms // 60000 for _, ms, _, _, _ in rows)
+        clusters = [(m, c) for m, c in minute_counts.most_common() if c >= self.CLUSTER_MIN]
+        if clusters:
+            cluster_str = "\n".join(
+                "`{}` • **{}**".format(self.format_ms(m * 60000)[:-3], c)
+                for m, c in clusters[: self.CLUSTER_SHOWN]
+            )
+            summary += "\n\n" + self.BULK_CLUSTERS.format(self.CLUSTER_MIN, cluster_str)
+        else:
+            summary += "\n\n" + self.BULK_NO_CLUSTERS.format(self.CLUSTER_MIN)
+
+        table_rows = [(i, self.format_ms(ms), w, p, inc) for i, ms, w, p, inc in rows]
+        if len(rows) <= self.BULK_TABLE_MAX:
+            table = "\n".join(" ".join(str(v) for v in row) for row in table_rows)
+            await ctx.reply(summary + "\n" + box(table), mention_author=False)
+        else:
+            csv_f = io.StringIO()
+            csv_w = csv.writer(csv_f)
+            csv_w.writerow(self.BULK_CSV_HEADER)
+            csv_w.writerows(table_rows)
+            csv_file = discord.File(io.BytesIO(csv_f.getvalue().encode()), "snowflakes.csv")
+            await ctx.reply(summary, file=csv_file, mention_author=False)
+
+    @commands.command(aliases=["time_to_snowflake"])
+    async def snowflake_range(
+        self, ctx: commands.Context, start: UTCTimeConverter, end: UTCTimeConverter = None
+    ):
+        """Convert a time (or time range) to the lowest and highest possible snowflakes
+
+        A time can be a Discord timestamp, a UNIX timestamp, an ISO time in UTC or a duration ago.
+        Put times containing spaces in quotes, e.g. `"2023-02-19 14:05"`.
+        These bounds can be used for the `before`/`after` of searches and history requests."""
+        end = start if end is None else end
+        if start > end:
+            msg = self.RANGE_REVERSED
+        else:
+            try:
+                low, high = self.time_to_snowflake(start), self.time_to_snowflake(end, high=True)
+            except ValueError:
+                msg = self.RANGE_OUT_OF_BOUNDS
+            else:
+                msg = self.RANGE_MSG.format(
+                    start=start.strftime(self.TIME_FORMAT),
+                    end=end.strftime(self.TIME_FORMAT),
+                    low=low,
+                    high=high,
+                )
+        await ctx.reply(msg, mention_author=False)
+
+    @commands.command()
+    @commands.guild_only()
+    async def goto_time(
+        self,
+        ctx: commands.Context,
+        channel: discord.TextChannel | discord.Thread,
+        *,
+        time: UTCTimeConverter,
+    ):
+        """Get a link to the first message in a channel after a certain time
+
+        A time can be a Discord timestamp, a UNIX timestamp, an ISO time in UTC or a duration ago.
+        This takes a single history request, no matter how long ago the time is."""
+        time_str = time.strftime(self.TIME_FORMAT)
+        try:
+            low = self.time_to_snowflake(time)
+        except ValueError:
+            await ctx.reply(self.RANGE_OUT_OF_BOUNDS, mention_author=False)
+            return
+        # `after` is exclusive, so go one below the lowest snowflake of that millisecond.
+        history = channel.history(limit=1, after=discord.Object(id=low - 1), oldest_first=True)
+        try:
+            message = next(iter([m async for m in history]), None)
+        except discord.Forbidden:
+            msg = self.GOTO_TIME_NO_PERMS.format(channel.mention)
+        else:
+            if message is not None:
+                msg = self.GOTO_TIME_FOUND.format(time=time_str, url=f"<{message.jump_url}>")
+            else:  # Link to the position in chat, as the goto command does.
+                url = self.GOTO_LINK.format(gld_id=ctx.guild.id, chn_id=channel.id, msg_id=low)
+                msg = self.GOTO_TIME_NONE.format(time=time_str, url=url)
+        await ctx.reply(msg, mention_author=False)
+
+    # Utilities
+    def time_to_snowflake(self, time: dt.datetime, high: bool = False) -> int:
+        """Get the lowest (or highest) possible snowflake of a time, i.e. the inverse of decoding
+
+        Raises ValueError if no snowflakes can exist for the time."""
+        ms = int(time.timestamp() * 1000) - self.DISCORD_EPOCH
+        if not 0 <= ms < 1 << 42:  # The timestamp takes the upper 42 bits.
+            raise ValueError("Time out of the snowflake range.")
+        return (ms << 22) + ((1 << 22) - 1 if high else 0)
+
+    def decode_snowflakes(self, ids: list[int]) -> list[tuple[int, int, int, int, int]]:
+        """Decode snowflakes into (ID, UNIX time in ms, worker, process, increment) tuples"""
+        epoch = self.DISCORD_EPOCH
+        return [
+            (i, (i >> 22) + epoch, (i >> 17) & 0x1F, (i >> 12) & 0x1F, i & 0xFFF) for i in ids
+        ]
+
+    def format_ms(self, ms: int) -> str:
+        """Format a UNIX time in milliseconds as a UTC time string"""
+        return dt.datetime.fromtimestamp(ms / 1000, dt.timezone.utc).strftime(self.TIME_FORMAT)
+
     # Config
     async def red_delete_data_for_user(self, *, _requester, _user_id):
         """Do nothing, as no user data is stored."""
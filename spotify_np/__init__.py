@@ -1,6 +1,9 @@
 from .spotify_np import SpotifyNP
 
-__red_end_user_data_statement__ = "No user data is stored by this cog."
+__red_end_user_data_statement__ = (
+    "No user data is stored by this cog. "
+    "What members are listening to on Spotify is only kept in memory, for server statistics."
+)
 
 
 async def setup(bot):
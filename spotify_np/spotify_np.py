@@ -1,21 +1,141 @@
+from __future__ import annotations
+# Default Library.
+import asyncio
+import collections
+import time
+
 # Required by Red.
 import discord
 from redbot.core import commands
 from redbot.core.bot import Red
 
 
+class GuildListeningIndex:
+    """Who is listening to which Spotify track on one guild, with rolling play counts
+
+    The play counts are kept in hourly buckets, which are trimmed once their hour has passed.
+    This keeps the memory usage bounded, no matter how many tracks are played."""
+
+    __slots__ = ("listeners", "member_tracks", "tracks", "buckets")
+
+    def __init__(self, window_hours: int):
+        self.listeners: dict[str, set[int]] = {}  # Track ID to member IDs.
+        self.member_tracks: dict[int, str] = {}  # Member ID to track ID.
+        self.tracks: dict[str, tuple[str, tuple[str, ...]]] = {}  # Track ID to (title, artists).
+        # Each bucket: (hour number, track play counter, artist play counter).
+        self.buckets: collections.deque = collections.deque(maxlen=window_hours)
+
+    def update(self, member_id: int, spot: discord.Spotify | None, now: float, count: bool = True):
+        """Process the (possibly absent) Spotify activity of a member"""
+        old_track = self.member_tracks.get(member_id)
+        new_track = spot.track_id if spot else None
+        if old_track == new_track:
+            return
+        if old_track is not None:
+            listeners = self.listeners[old_track]
+            listeners.discard(member_id)
+            if not listeners:
+                del self.listeners[old_track]
+        if new_track is None:
+            del self.member_tracks[member_id]
+        else:
+            self.member_tracks[member_id] = new_track
+            self.listeners.setdefault(new_track, set()).add(member_id)
+            self.tracks[new_track] = (spot.title, tuple(spot.artists))
+            if count:
+                _, track_counter, artist_counter = self.current_bucket(now)
+                track_counter[new_track] += 1
+                artist_counter.update(spot.artists)
+
+    def current_bucket(self, now: float) -> tuple[int, collections.Counter, collections.Counter]:
+        """Get the bucket of the current hour, rotating the buckets if a new hour has started"""
+        hour = int(now // 3600)
+        if not self.buckets or self.buckets[-1][0] != hour:
+            if self.buckets:  # The previous hour is done, so only its top entries are needed.
+                self.trim_bucket(self.buckets[-1])
+            self.buckets.append((hour, collections.Counter(), collections.Counter()))
+            self.prune_tracks()
+        return self.buckets[-1]
+
+    @staticmethod
+    def trim_bucket(bucket: tuple[int, collections.Counter, collections.Counter]):
+        """Only keep the most played entries of a bucket"""
+        for counter in bucket[1:]:
+            if len(counter) > SpotifyNP.MAX_BUCKET_ENTRIES:
+                kept = counter.most_common(SpotifyNP.MAX_BUCKET_ENTRIES)
+                counter.clear()
+                counter.update(dict(kept))
+
+    def prune_tracks(self):
+        """Forget the metadata of tracks that are neither playing nor counted anymore"""
+        counted = set(self.listeners).union(*(b[1] for b in self.buckets))
+        for track_id in self.tracks.keys() - counted:
+            del self.tracks[track_id]
+
+    def top(self, now: float, hours: int, n: int) -> tuple[list, list]:
+        """Get the n most played tracks and artists of the last hours"""
+        first_hour = int(now // 3600) - hours + 1
+        track_total, artist_total = collections.Counter(), collections.Counter()
+        for hour, track_counter, artist_counter in self.buckets:
+            if hour >= first_hour:
+                track_total.update(track_counter)
+                artist_total.update(artist_counter)
+        return track_total.most_common(n), artist_total.most_common(n)
+
+
 class SpotifyNP(commands.Cog):
     """Spotify now playing"""
 
     __author__ = "#s#8059"
-    __red_end_user_data_statement__ = "No user data is stored by this cog."
+    __red_end_user_data_statement__ = (
+        "No user data is stored by this cog. "
+        "What members are listening to on Spotify is only kept in memory, for server statistics."
+    )
     SPOTIFY_NOT_LISTENING = (
         "User is not currently listening to Spotify, or is listening to a local file."
     )
+    NOBODY_LISTENING = "Nobody on this server is currently listening to Spotify."
+    NOTHING_PLAYED = "Nothing has been played on Spotify on this server in the last {} hours."
+    # Other constants.
+    TRACK_URL = "https://open.spotify.com/track/{}"
+    TOP_N = 10
+    WINDOW_HOURS = 24
+    MAX_BUCKET_ENTRIES = 500  # Per hour, for both tracks and artists.
+    EMBED_CACHE_SIZE = 256
 
     def __init__(self, bot: Red):
         super().__init__()
         self.bot = bot
+        self.indexes: dict[int, GuildListeningIndex] = {}
+        self.seed_task: asyncio.Task | None = None
+        # Member-independent track embeds, least recently used first.
+        self.embed_cache: collections.OrderedDict[str, discord.Embed] = collections.OrderedDict()
+        self.embed_cache_hits = 0
+        self.embed_cache_misses = 0
+
+    async def cog_load(self):
+        self.seed_task = asyncio.create_task(self.seed_indexes())
+
+    async def cog_unload(self):
+        if self.seed_task is not None:
+            self.seed_task.cancel()
+
+    # Events
+    @commands.Cog.listener()
+    async def on_presence_update(self, before: discord.Member, after: discord.Member):
+        """Keep the listening index of the member's guild up to date"""
+        self.guild_index(after.guild.id).update(after.id, self.get_spotify(after), time.time())
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        """Members that leave are no longer listening on this server"""
+        index = self.indexes.get(member.guild.id)
+        if index is not None:
+            index.update(member.id, None, time.time())
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.indexes.pop(guild.id, None)
 
     # Commands
     @commands.command()
@@ -25,21 +145,128 @@ class SpotifyNP(commands.Cog):
             user = ctx.author
         spot = next((act for act in user.activities if isinstance(act, discord.Spotify)), None)
         if spot:
+            embed = self.track_embed(spot)
+            embed.title = "Spotify of {} - Currently playing".format(user.name)
+            await ctx.reply(embed=embed, mention_author=False)
+        else:
+            await ctx.reply(self.SPOTIFY_NOT_LISTENING, mention_author=False)
+
+    @commands.command(aliases=["listening"])
+    @commands.guild_only()
+    async def spotify_now(self, ctx: commands.Context):
+        """Show the tracks that are currently played the most on this server
+
+        Requires the presence intent to be enabled for the bot."""
+        index = self.guild_index(ctx.guild.id)
+        top_tracks = sorted(index.listeners.items(), key=lambda x: len(x[1]), reverse=True)
+        if not top_tracks:
+            await ctx.reply(self.NOBODY_LISTENING, mention_author=False)
+        else:
+            rows = (
+                "`{}` {} • **{}**".format(n, self.track_str(index, track_id), len(listeners))
+                for n, (track_id, listeners) in enumerate(top_tracks[: self.TOP_N], start=1)
+            )
+            embed = discord.Embed(colour=discord.Colour.green(), title="Spotify - Now playing")
+            embed.description = "\n".join(rows)
+            embed.set_footer(text=f"Members listening: {len(index.member_tracks)}")
+            await ctx.reply(embed=embed, mention_author=False)
+
+    @commands.command()
+    @commands.guild_only()
+    async def spotify_top(self, ctx: commands.Context):
+        """Show the most played tracks and artists on this server in the last 24 hours
+
+        Requires the presence intent to be enabled for the bot."""
+        index = self.guild_index(ctx.guild.id)
+        top_tracks, top_artists = index.top(time.time(), self.WINDOW_HOURS, self.TOP_N)
+        if not top_tracks:
+            await ctx.reply(self.NOTHING_PLAYED.format(self.WINDOW_HOURS), mention_author=False)
+        else:
+            track_rows = (
+                "`{}` {} • **{}**".format(n, self.track_str(index, track_id), plays)
+                for n, (track_id, plays) in enumerate(top_tracks, start=1)
+            )
+            artist_rows = (
+                "`{}` {} • **{}**".format(n, artist, plays)
+                for n, (artist, plays) in enumerate(top_artists, start=1)
+            )
+            embed = discord.Embed(colour=discord.Colour.green(), title="Spotify - Top 24 hours")
+            embed.add_field(name="Tracks", value="\n".join(track_rows), inline=False)
+            embed.add_field(name="Artists", value="\n".join(artist_rows), inline=False)
+            await ctx.reply(embed=embed, mention_author=False)
+
+    @commands.command()
+    @commands.is_owner()
+    async def spotify_cache(self, ctx: commands.Context):
+        """Show the statistics of the track embed cache"""
+        lookups = self.embed_cache_hits + self.embed_cache_misses
+        hit_rate = self.embed_cache_hits / lookups if lookups else 0
+        msg = (
+            f"**Cached tracks:** {len(self.embed_cache)} of {self.EMBED_CACHE_SIZE}\n"
+            f"**Hits:** {self.embed_cache_hits}\n"
+            f"**Misses:** {self.embed_cache_misses}\n"
+            f"**Hit rate:** {hit_rate:.1%}"
+        )
+        await ctx.reply(msg, mention_author=False)
+
+    # Utilities
+    def track_embed(self, spot: discord.Spotify) -> discord.Embed:
+        """Get a copy of the (cached) embed of a track, without a title
+
+        Local files have no track ID, so their embeds are not cached."""
+        cache_key = spot.track_id
+        embed = self.embed_cache.get(cache_key) if cache_key else None
+        if embed is not None:
+            self.embed_cache_hits += 1
+            self.embed_cache.move_to_end(cache_key)
+        else:
+            self.embed_cache_misses += 1
             # Create value for song field.
             minutes, seconds = divmod(spot.duration.seconds, 60)
             song_length = "{:02d}:{:02d}".format(minutes, seconds)
-            song_url = "https://open.spotify.com/track/{}".format(spot.track_id)
+            song_url = self.TRACK_URL.format(spot.track_id)
             song_value = "[{}]({}) ({})".format(spot.title, song_url, song_length)
             # Create embed.
             embed = discord.Embed(colour=spot.colour)
-            embed.title = "Spotify of {} - Currently playing".format(user.name)
             embed.add_field(name="Song", value=song_value, inline=False)
             embed.add_field(name="Artist", value=",".join(spot.artists), inline=False)
             embed.add_field(name="Album", value=spot.album, inline=False)
             embed.set_thumbnail(url=spot.album_cover_url)
-            await ctx.reply(embed=embed, mention_author=False)
-        else:
-            await ctx.reply(self.SPOTIFY_NOT_LISTENING, mention_author=False)
+            if cache_key:
+                self.embed_cache[cache_key] = embed
+                if len(self.embed_cache) > self.EMBED_CACHE_SIZE:
+                    self.embed_cache.popitem(last=False)
+        return embed.copy()  # The title is set per member, so never hand out the cached one.
+
+    @staticmethod
+    def get_spotify(member: discord.Member) -> discord.Spotify | None:
+        """Get the Spotify activity of a member, ignoring local files (which have no track ID)"""
+        spot = next((a for a in member.activities if isinstance(a, discord.Spotify)), None)
+        return spot if spot is not None and spot.track_id else None
+
+    def guild_index(self, guild_id: int) -> GuildListeningIndex:
+        """Get the listening index of a guild, creating it if needed"""
+        index = self.indexes.get(guild_id)
+        if index is None:
+            index = self.indexes[guild_id] = GuildListeningIndex(self.WINDOW_HOURS)
+        return index
+
+    async def seed_indexes(self):
+        """Fill the indexes once with the members that were already listening before loading"""
+        await self.bot.wait_until_red_ready()
+        now = time.time()
+        for gld in self.bot.guilds:
+            index = self.guild_index(gld.id)
+            for member in gld.members:
+                spot = self.get_spotify(member)
+                if spot is not None:
+                    index.update(member.id, spot, now, count=False)
+            await asyncio.sleep(0)  # Let other tasks run between guilds.
+
+    def track_str(self, index: GuildListeningIndex, track_id: str) -> str:
+        """Get a hyperlinked description of a track in an index"""
+        title, artists = index.tracks.get(track_id, ("Unknown track", ()))
+        return "[{}]({}) by {}".format(title, self.TRACK_URL.format(track_id), ", ".join(artists))
 
     # Config
     async def red_delete_data_for_user(self, *, _requester, _user_id):
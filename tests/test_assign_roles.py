@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+
+from assign_roles.assign_roles import AssignRoles
+from benchmarks.fakes import FakeBot, FakeContext, generate_guild
+from benchmarks.memory_driver import offline_red
+
+
+class PartialEntryTest(unittest.IsolatedAsyncioTestCase):
+    """Custom group entries are stored without their registered defaults"""
+
+    async def asyncSetUp(self):
+        self.red = offline_red()
+        self.red.__enter__()
+        self.gld = generate_guild(20, 5, seed=1)
+        self.gld.owner = self.gld.members[0]
+        self.cog = AssignRoles(FakeBot(self.gld))
+        await self.cog.cog_load()
+        self.roles = [r for r in self.gld.roles if not r.is_default()]
+
+    async def asyncTearDown(self):
+        await self.cog.cog_unload()
+        self.red.__exit__(None, None, None)
+
+    async def test_rule_with_only_inherits(self):
+        helper, source, giveable = self.roles[:3]
+        auth_entry = self.cog.config.custom(self.cog.AUTH_GROUP, self.gld.id, giveable.id)
+        await auth_entry.authorised.set([source.id])
+        rule_entry = self.cog.config.custom(self.cog.RULE_GROUP, self.gld.id, helper.id)
+        await rule_entry.inherits.set([source.id])  # No ranges are stored for this role.
+        stored = await self.cog.config.custom(self.cog.RULE_GROUP, self.gld.id).all()
+        self.assertEqual(stored, {str(helper.id): {"inherits": [source.id]}})
+
+        closure = await self.cog.effective_authorisations(self.gld)
+        self.assertEqual(closure[giveable.id], frozenset({helper.id, source.id}))
+        ctx = FakeContext(self.gld, self.gld.owner)
+        await self.cog.rules.callback(self.cog, ctx)
+        self.assertEqual(len(ctx.sent[-1]["embed"].fields), 1)
+
+    async def test_deauthorise_last_entry(self):
+        authorised, giveable = self.roles[:2]
+        ctx = FakeContext(self.gld, self.gld.owner)
+        await self.cog.authorise.callback(self.cog, ctx, authorised, giveable)
+        await self.cog.deauthorise.callback(self.cog, ctx, authorised, giveable)
+        self.assertEqual(await self.cog.config.custom(self.cog.AUTH_GROUP, self.gld.id).all(), {})
+
+        self.assertEqual(await self.cog.effective_authorisations(self.gld), {})
+        await self.cog.list.callback(self.cog, ctx)
+        self.assertEqual(ctx.sent[-1]["embed"].description, self.cog.LIST_DESC_EMPTY)
+
+
+class MergedToggleTest(unittest.IsolatedAsyncioTestCase):
+    """Only the role changes that reach Discord are written to the audit log"""
+
+    async def asyncSetUp(self):
+        self.red = offline_red()
+        self.red.__enter__()
+        self.gld = generate_guild(20, 5, seed=1)
+        self.author, self.target = self.gld.members[:2]
+        self.cog = AssignRoles(FakeBot(self.gld))
+        await self.cog.cog_load()
+        self.cog.edit_queue.WINDOW = 0.01
+        self.giver, self.role = [r for r in self.gld.roles if not r.is_default()][:2]
+        self.author.roles = [self.gld.default_role, self.giver]
+        self.target.roles = [self.gld.default_role]
+        auth_entry = self.cog.config.custom(self.cog.AUTH_GROUP, self.gld.id, self.role.id)
+        await auth_entry.authorised.set([self.giver.id])
+
+    async def asyncTearDown(self):
+        await self.cog.cog_unload()
+        self.red.__exit__(None, None, None)
+
+    async def toggle(self, times: int):
+        ctxs = [FakeContext(self.gld, self.author) for _ in range(times)]
+        await asyncio.gather(
+            *(self.cog._assign.callback(self.cog, ctx, self.role, self.target) for ctx in ctxs)
+        )
+        return await self.cog.audit_log.query(self.gld.id, "target", self.target.id, 10)
+
+    async def test_cancelled_toggles(self):
+        count, _ = await self.toggle(2)
+        self.assertNotIn(self.role, self.target.roles)
+        self.assertEqual(count, 0)
+
+    async def test_merged_toggles(self):
+        count, records = await self.toggle(3)
+        self.assertIn(self.role, self.target.roles)
+        self.assertEqual(count, 3)
+        self.assertTrue(all(r.added for r in records))
+
+
+if __name__ == "__main__":
+    unittest.main()
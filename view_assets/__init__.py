@@ -1,7 +1,10 @@
 from .view_assets import ViewAssets
 
 
-__red_end_user_data_statement__ = "No user data is stored by this cog."
+__red_end_user_data_statement__ = (
+    "No user data is stored by this cog, except for a cache of avatar images. "
+    "These are stored under an image hash (not per user), when staff archive avatars of a role."
+)
 
 
 async def setup(bot):
@@ -0,0 +1,106 @@
+from __future__ import annotations
+# Default Library.
+import asyncio
+import os.path
+import zipfile
+
+# Used by Red.
+import aiohttp
+import discord
+
+
+class AvatarCache:
+    """Content-addressed on-disk cache of avatars
+
+    Avatars are stored under their asset key, which Discord derives from the image itself.
+    Consequently, an avatar is downloaded at most once, even if several members share it.
+    Downloads go through one HTTP session, with a cap on the amount of simultaneous requests.
+    """
+
+    def __init__(self, folder: str, concurrency: int = 8, size: int = 256):
+        self.folder = folder
+        self.size = size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session: aiohttp.ClientSession | None = None
+        self.in_flight: dict[str, asyncio.Task] = {}  # Prevents fetching one key twice at once.
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def asset_info(asset: discord.Asset) -> tuple[str, str]:
+        """Get the cache key and file extension of an avatar asset"""
+        return asset.key, "gif" if asset.is_animated() else "png"
+
+    def asset_url(self, asset: discord.Asset) -> str:
+        """Get the URL to download an avatar asset from, in the cached size and format"""
+        return asset.with_static_format("png").with_size(self.size).url
+
+    def path(self, key: str, ext: str) -> str:
+        """Get the path of a cached file (which may not exist yet)"""
+        return os.path.join(self.folder, f"{key}.{ext}")
+
+    async def fetch_asset(self, asset: discord.Asset) -> str | None:
+        """Get the path of a cached avatar asset, downloading it if needed"""
+        key, ext = self.asset_info(asset)
+        return await self.fetch(key, ext, self.asset_url(asset))
+
+    async def fetch(self, key: str, ext: str, url: str) -> str | None:
+        """Get the path of a cached file, downloading it from url if needed
+
+        Returns None if the download failed."""
+        path = self.path(key, ext)
+        if os.path.isfile(path):
+            return path
+        task = self.in_flight.get(path)
+        if task is None:
+            task = self.in_flight[path] = asyncio.create_task(self.download(url, path))
+            task.add_done_callback(lambda _: self.in_flight.pop(path, None))
+        return await asyncio.shield(task)
+
+    async def fetch_many(self, assets: list[discord.Asset]) -> list[str | None]:
+        """Get the paths of multiple avatar assets concurrently, in the same order"""
+        return await asyncio.gather(*(self.fetch_asset(a) for a in assets))
+
+    async def download(self, url: str, path: str) -> str | None:
+        """Download a file to path, and return path if successful"""
+        data = await self.fetch_bytes(url)
+        if data is None:
+            return None
+        await asyncio.get_running_loop().run_in_executor(None, self.write_file, path, data)
+        return path
+
+    async def fetch_bytes(self, url: str) -> bytes | None:
+        """Download a file without storing it, sharing the session and concurrency cap"""
+        async with self.semaphore:
+            try:
+                async with self.get_session().get(url) as resp:
+                    if resp.status != 200:
+                        return None
+                    return await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None
+
+    @staticmethod
+    def write_file(path: str, data: bytes):
+        """Write a file atomically, such that a cached file is never partially written"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def write_zip(zip_path: str, entries: list[tuple[str, str]]):
+        """Write (name in archive, cached file path) pairs to a zip file, one file at a time
+
+        Images are already compressed, so the files are stored as-is."""
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED) as zip_f:
+            for arc_name, path in entries:
+                zip_f.write(path, arc_name)
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
@@ -0,0 +1,66 @@
+from __future__ import annotations
+# Default Library.
+import collections
+from typing import Callable, Dict, Union
+
+# Required by Red.
+import discord
+from redbot.core.utils.menus import SimpleMenu
+from redbot.vendored.discord.ext import menus
+
+Page = Union[str, discord.Embed, Dict[str, Union[str, discord.Embed]]]
+
+
+class LazyPageSource(menus.ListPageSource):
+    """Page source that only renders the pages that are viewed
+
+    The most recently rendered pages are kept, such that flipping back and forth is cheap."""
+
+    def __init__(self, page_count: int, render_page: Callable[[int], Page], cache_size: int):
+        super().__init__(range(page_count), per_page=1)  # The entries are the page numbers.
+        self.render_page = render_page
+        self.cache_size = cache_size
+        self.cache: collections.OrderedDict[int, Page] = collections.OrderedDict()
+
+    async def format_page(self, view: discord.ui.View, page_number: int) -> Page:
+        page = self.cache.get(page_number)
+        if page is None:
+            page = self.cache[page_number] = self.render_page(page_number)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(page_number)
+        return page
+
+
+class LazyMenu(SimpleMenu):
+    """SimpleMenu that renders its pages on demand, rather than taking a list of pages
+
+    render_page is called with a page number (starting at 0), and returns anything that
+     SimpleMenu accepts as a page. The memory and time needed to start the menu are thus
+     independent of the amount of pages."""
+
+    def __init__(
+        self,
+        page_count: int,
+        render_page: Callable[[int], Page],
+        *,
+        cache_size: int = 3,
+        **kwargs,
+    ):
+        # SimpleMenu already uses the source while initialising, so it must be set beforehand.
+        self._lazy_source = LazyPageSource(page_count, render_page, cache_size)
+        super().__init__(range(page_count), **kwargs)
+
+    @property
+    def source(self) -> LazyPageSource:
+        return self._lazy_source
+
+    def stop(self):
+        """Stop the menu, and release the rendered pages"""
+        super().stop()
+        self._lazy_source.cache.clear()
+
+    async def on_timeout(self):
+        await super().on_timeout()
+        self._lazy_source.cache.clear()
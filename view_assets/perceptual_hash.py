@@ -0,0 +1,162 @@
+from __future__ import annotations
+# Default Library.
+import collections
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # Colour type to the amount of channels.
+HASH_WIDTH, HASH_HEIGHT = 9, 8  # One more column than bits per row, as columns are compared.
+
+
+def decode_png_luminance(data: bytes) -> tuple[int, int, list[float]] | None:
+    """Decode a PNG image into its width, height and row-major luminance values (0-255)
+
+    Only the standard library is used, so only non-interlaced, 8-bit images are supported.
+    Transparency is composited on black. Returns None for unsupported or broken images."""
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    pos = len(PNG_SIGNATURE)
+    header, palette, idat_chunks = None, None, []
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos : pos + 8])
+        chunk = data[pos + 8 : pos + 8 + length]
+        pos += length + 12  # Length, type and CRC take 12 bytes.
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif chunk_type == b"PLTE":
+            palette = [luminance(*chunk[i : i + 3]) for i in range(0, len(chunk) - 2, 3)]
+        elif chunk_type == b"IDAT":
+            idat_chunks.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+    if header is None:
+        return None
+    width, height, bit_depth, colour_type, _, _, interlace = header
+    if bit_depth != 8 or interlace or colour_type not in PNG_CHANNELS:
+        return None
+    if colour_type == 3 and palette is None:
+        return None
+    try:
+        raw = zlib.decompress(b"".join(idat_chunks))
+    except zlib.error:
+        return None
+    channels = PNG_CHANNELS[colour_type]
+    stride = width * channels
+    if len(raw) < (stride + 1) * height:
+        return None
+
+    pixels = []
+    prev = bytearray(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        line = bytearray(raw[start + 1 : start + 1 + stride])
+        unfilter_line(raw[start], line, prev, channels)
+        if colour_type == 0:
+            pixels.extend(line)
+        elif colour_type == 2:
+            pixels.extend(luminance(*line[x : x + 3]) for x in range(0, stride, 3))
+        elif colour_type == 3:
+            pixels.extend(palette[i] if i < len(palette) else 0 for i in line)
+        elif colour_type == 4:
+            pixels.extend(line[x] * line[x + 1] / 255 for x in range(0, stride, 2))
+        else:  # colour_type == 6
+            pixels.extend(
+                luminance(*line[x : x + 3]) * line[x + 3] / 255 for x in range(0, stride, 4)
+            )
+        prev = line
+    return width, height, pixels
+
+
+def unfilter_line(filter_type: int, line: bytearray, prev: bytearray, bpp: int) -> bytearray:
+    """Undo the PNG filter of one scanline (in place)"""
+    if filter_type == 1:  # Sub.
+        for x in range(bpp, len(line)):
+            line[x] = (line[x] + line[x - bpp]) & 0xFF
+    elif filter_type == 2:  # Up.
+        for x in range(len(line)):
+            line[x] = (line[x] + prev[x]) & 0xFF
+    elif filter_type == 3:  # Average.
+        for x in range(len(line)):
+            left = line[x - bpp] if x >= bpp else 0
+            line[x] = (line[x] + ((left + prev[x]) >> 1)) & 0xFF
+    elif filter_type == 4:  # Paeth.
+        for x in range(len(line)):
+            a = line[x - bpp] if x >= bpp else 0
+            b = prev[x]
+            c = prev[x - bpp] if x >= bpp else 0
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            predictor = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+            line[x] = (line[x] + predictor) & 0xFF
+    return line
+
+
+def luminance(r: int, g: int, b: int) -> float:
+    return 0.299 * r + 0.587 * g + 0.114 * b
+
+
+def difference_hash(data: bytes) -> int | None:
+    """Compute the 64-bit difference hash (dHash) of a PNG image
+
+    The image is downscaled to 9x8 luminance values by averaging, after which each bit tells
+     whether a value is brighter than its right neighbour.
+    Near copies (rescaled, recompressed, slightly edited) get hashes with few differing bits."""
+    decoded = decode_png_luminance(data)
+    if decoded is None:
+        return None
+    width, height, pixels = decoded
+    if width < HASH_WIDTH or height < HASH_HEIGHT:
+        return None
+    # Box-average each cell of the 9x8 grid.
+    x_bounds = [x * width // HASH_WIDTH for x in range(HASH_WIDTH + 1)]
+    y_bounds = [y * height // HASH_HEIGHT for y in range(HASH_HEIGHT + 1)]
+    hash_value = 0
+    for gy in range(HASH_HEIGHT):
+        rows = range(y_bounds[gy], y_bounds[gy + 1])
+        cells = []
+        for gx in range(HASH_WIDTH):
+            x0, x1 = x_bounds[gx], x_bounds[gx + 1]
+            total = sum(sum(pixels[y * width + x0 : y * width + x1]) for y in rows)
+            cells.append(total / (len(rows) * (x1 - x0)))
+        for gx in range(HASH_WIDTH - 1):
+            hash_value = (hash_value << 1) | (cells[gx] > cells[gx + 1])
+    return hash_value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class HashIndex:
+    """Index of 64-bit hashes, split into 8 bands of 8 bits
+
+    Two hashes that differ in at most 7 bits are equal in at least one band (pigeonhole).
+    Thus, a query only has to compare against the hashes sharing a band value,
+     rather than against every hash in the index."""
+
+    BANDS = 8
+    BAND_BITS = 8
+    MAX_DISTANCE = BANDS - 1
+
+    def __init__(self):
+        self.buckets = [collections.defaultdict(list) for _ in range(self.BANDS)]
+
+    def band_values(self, hash_value: int):
+        mask = (1 << self.BAND_BITS) - 1
+        return ((hash_value >> (b * self.BAND_BITS)) & mask for b in range(self.BANDS))
+
+    def add(self, item, hash_value: int):
+        for bucket, band_value in zip(self.buckets, self.band_values(hash_value)):
+            bucket[band_value].append((item, hash_value))
+
+    def query(self, hash_value: int, max_distance: int) -> dict:
+        """Get all items within max_distance (at most 7) bits of a hash, with their distance"""
+        matches = {}
+        for bucket, band_value in zip(self.buckets, self.band_values(hash_value)):
+            for item, other_hash in bucket.get(band_value, ()):
+                if item not in matches:
+                    distance = hamming_distance(hash_value, other_hash)
+                    if distance <= max_distance:
+                        matches[item] = distance
+        return matches
@@ -1,8 +1,22 @@
+from __future__ import annotations
+# Default Library.
+import asyncio
+import collections
+import json
+import os.path
+import re
+import tempfile
+
 # Required by Red.
 import discord
-from redbot.core.utils.menus import SimpleMenu
-from redbot.core import commands
+from redbot.core import commands, data_manager
 from redbot.core.bot import Red
+from redbot.core.utils.chat_formatting import pagify
+
+# Local.
+from .avatar_cache import AvatarCache
+from .lazy_menu import LazyMenu
+from .perceptual_hash import HashIndex, difference_hash
 
 
 class ViewAssets(commands.Cog):
@@ -12,12 +26,36 @@ class ViewAssets(commands.Cog):
     # Messages.
     X = ":x: Error: "
     MEMBER_NO_GUILD_AVATAR = X + "this user does not have a server avatar."
+    ROLE_NO_MEMBERS = X + "this role has no members."
+    ARCHIVE_TOO_BIG = (
+        X + "the avatar archive is too big to send here!\n\n**Size:** {fs}\n**Limit:** {fl}"
+    )
+    ARCHIVE_MSG = "Here are the avatars of the **{n}** members of {role}."
+    ARCHIVE_FAILED = "\nThe avatars of {} members could not be downloaded."
+    SCAN_NO_STAFF = X + "none of the members of {} have an avatar that could be scanned."
+    SCAN_NOTHING = "No members have an avatar resembling that of a member of {}."
+    SCAN_ROW = "{staff}: {suspects}"
     # Other constants.
     IMAGE_HYPERLINK = "**Image link:**  [Click here]({})"
+    ONE_MB = 1024 * 1024  # From bytes to MB.
+    DOWNLOAD_CONCURRENCY = 8
+    HASHES_NAME = "avatar_hashes.json"
+    HASH_IMAGE_SIZE = 64  # Plenty for a 9x8 hash, and quick to download and decode.
+    HASH_BATCH = 500  # Avatars downloaded and hashed per batch.
+    NO_HASH = -1  # Stored for avatars that could not be decoded, so they are not retried.
 
     def __init__(self, bot: Red):
         super().__init__()
         self.bot = bot
+        self.FOLDER = str(data_manager.cog_data_path(self))
+        self.HASHES_FP = os.path.join(self.FOLDER, self.HASHES_NAME)
+        self.avatar_cache = AvatarCache(
+            os.path.join(self.FOLDER, "avatars"), concurrency=self.DOWNLOAD_CONCURRENCY
+        )
+        self.avatar_hashes: dict[str, int] | None = None  # Avatar key to dHash, loaded lazily.
+
+    async def cog_unload(self):
+        await self.avatar_cache.close()
 
     # Commands
     @commands.command()
@@ -64,16 +102,173 @@ class ViewAssets(commands.Cog):
             "Server Invite Splash": gld.splash.url if gld.splash else None,
             "Server Discovery Splash": gld.discovery_splash.url if gld.discovery_splash else None,
         }
-        embed_list = []
-        for name, img_url in img_dict.items():
-            if img_url:
-                embed = discord.Embed(colour=discord.Colour.blurple(), title=name)
-                embed.description = self.IMAGE_HYPERLINK.format(img_url)
-                embed.set_image(url=img_url)
-                embed_list.append(embed)
-        if not embed_list:
+        images = [(name, img_url) for name, img_url in img_dict.items() if img_url]
+
+        def render_page(i: int) -> discord.Embed:
+            name, img_url = images[i]
+            embed = discord.Embed(colour=discord.Colour.blurple(), title=name)
+            embed.description = self.IMAGE_HYPERLINK.format(img_url)
+            embed.set_image(url=img_url)
+            return embed
+
+        if not images:
             await ctx.send("No images.")
-        await SimpleMenu(embed_list).start(ctx)
+        else:
+            await LazyMenu(len(images), render_page).start(ctx)
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.mod_or_permissions(manage_roles=True)
+    @commands.bot_has_permissions(attach_files=True)
+    async def avatar_archive(self, ctx: commands.Context, role: discord.Role):
+        """Get the (server) avatars of all members of a role in a zip file
+
+        Avatars are cached by the bot, so an avatar is only downloaded once."""
+        members = role.members
+        if not members:
+            await ctx.reply(self.ROLE_NO_MEMBERS, mention_author=False)
+            return
+        async with ctx.typing():
+            paths = await self.avatar_cache.fetch_many([m.display_avatar for m in members])
+            entries = [
+                ("{}_{}{}".format(m.id, re.sub(r"\W+", "", m.name), os.path.splitext(p)[1]), p)
+                for m, p in zip(members, paths)
+                if p is not None
+            ]
+            # A unique name per invocation, as the same role may be archived concurrently.
+            zip_fd, zip_path = tempfile.mkstemp(suffix=".zip", dir=self.FOLDER)
+            os.close(zip_fd)
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, AvatarCache.write_zip, zip_path, entries)
+            except BaseException:
+                os.remove(zip_path)
+                raise
+        try:
+            zip_size = os.path.getsize(zip_path)
+            size_limit = ctx.guild.filesize_limit
+            if zip_size > size_limit:
+                fs = self.file_size_in_mb(zip_size)
+                fl = self.file_size_in_mb(size_limit)
+                await ctx.reply(self.ARCHIVE_TOO_BIG.format(fs=fs, fl=fl), mention_author=False)
+            else:
+                msg = self.ARCHIVE_MSG.format(n=len(entries), role=role.mention)
+                if len(entries) < len(members):
+                    msg += self.ARCHIVE_FAILED.format(len(members) - len(entries))
+                zip_file = discord.File(zip_path, filename=f"{role.name} avatars.zip")
+                no_pings = discord.AllowedMentions.none()
+                await ctx.reply(msg, file=zip_file, mention_author=False, allowed_mentions=no_pings)
+        finally:  # The avatars stay cached, so the zip file itself is not kept.
+            os.remove(zip_path)
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.mod_or_permissions(manage_roles=True)
+    async def impersonation_scan(
+        self, ctx: commands.Context, staff_role: discord.Role, max_distance: int = 6
+    ):
+        """Find members whose avatar looks like the avatar of a member of a (staff) role
+
+        Avatars are compared with a perceptual hash, which also catches rescaled
+         or slightly edited copies. max_distance (0 to 7) is the amount of bits in which
+         two hashes may differ; 0 only matches avatars that look the same.
+        Hashes are cached, so only new avatars are downloaded."""
+        max_distance = max(0, min(max_distance, HashIndex.MAX_DISTANCE))
+        # Group members on avatar, as identical avatars only need one download and hash.
+        key_members = collections.defaultdict(list)
+        assets = {}
+        for member in ctx.guild.members:
+            if member.avatar or member.guild_avatar:  # Default avatars are shared by design.
+                asset = member.display_avatar
+                key_members[asset.key].append(member)
+                assets[asset.key] = asset
+        async with ctx.typing():
+            hashes = await self.hash_avatars(assets)
+            index = HashIndex()
+            for key in key_members:
+                if hashes.get(key, self.NO_HASH) != self.NO_HASH:
+                    index.add(key, hashes[key])
+
+            staff_rows = []
+            staff_scanned = 0
+            for staff in staff_role.members:
+                staff_hash = hashes.get(staff.display_avatar.key, self.NO_HASH)
+                if staff_hash == self.NO_HASH:  # Default avatar, or one that cannot be decoded.
+                    continue
+                staff_scanned += 1
+                matches = index.query(staff_hash, max_distance)
+                suspects = sorted(
+                    (
+                        (distance, member)
+                        for key, distance in matches.items()
+                        for member in key_members[key]
+                        if staff_role not in member.roles
+                    ),
+                    key=lambda x: x[0],
+                )
+                if suspects:
+                    suspects_str = ", ".join(f"{m.mention} (`{d}`)" for d, m in suspects)
+                    row = self.SCAN_ROW.format(staff=staff.mention, suspects=suspects_str)
+                    staff_rows.append(row)
+
+        if staff_scanned == 0:
+            to_send = self.SCAN_NO_STAFF.format(staff_role.mention)
+        elif not staff_rows:
+            to_send = self.SCAN_NOTHING.format(staff_role.mention)
+        else:
+            to_send = "\n".join(staff_rows)
+        no_pings = discord.AllowedMentions.none()
+        for page in pagify(to_send, delims=["\n", ", "]):
+            await ctx.send(page, allowed_mentions=no_pings)
+
+    # Utilities
+    async def hash_avatars(self, assets: dict[str, discord.Asset]) -> dict[str, int]:
+        """Get the perceptual hashes of avatars, keyed by avatar key
+
+        Only avatars without a cached hash are downloaded. Avatars that could not be downloaded
+         are left out (and retried next time); those that could not be decoded get NO_HASH."""
+        loop = asyncio.get_running_loop()
+        if self.avatar_hashes is None:
+            self.avatar_hashes = await loop.run_in_executor(None, self.load_avatar_hashes)
+        hashes = self.avatar_hashes
+        missing = [key for key in assets if key not in hashes]
+        for i in range(0, len(missing), self.HASH_BATCH):
+            batch = missing[i : i + self.HASH_BATCH]
+            images = await asyncio.gather(
+                *(
+                    self.avatar_cache.fetch_bytes(
+                        assets[key].replace(format="png", size=self.HASH_IMAGE_SIZE).url
+                    )
+                    for key in batch
+                )
+            )
+            batch_hashes = await loop.run_in_executor(
+                None, lambda: [difference_hash(img) if img else None for img in images]
+            )
+            for key, image, hash_value in zip(batch, images, batch_hashes):
+                if image is not None:
+                    hashes[key] = self.NO_HASH if hash_value is None else hash_value
+        if missing:
+            await loop.run_in_executor(None, self.save_avatar_hashes, dict(hashes))
+        return hashes
+
+    def load_avatar_hashes(self) -> dict[str, int]:
+        """Load the cached avatar hashes from the data folder"""
+        if not os.path.isfile(self.HASHES_FP):
+            return {}
+        with open(self.HASHES_FP, encoding="utf-8") as hashes_f:
+            return json.load(hashes_f)
+
+    def save_avatar_hashes(self, hashes: dict[str, int]):
+        """Save the avatar hashes to the data folder, atomically"""
+        tmp_fp = self.HASHES_FP + ".tmp"
+        with open(tmp_fp, "w", encoding="utf-8") as hashes_f:
+            json.dump(hashes, hashes_f)
+        os.replace(tmp_fp, self.HASHES_FP)
+
+    def file_size_in_mb(self, size_in_bytes: int) -> str:
+        """Get a string representing the file size in MB"""
+        return "{} MB".format(round(size_in_bytes / self.ONE_MB, 2))
 
     # Config
     async def red_delete_data_for_user(self, *, _requester, _user_id):
@@ -0,0 +1,122 @@
+from __future__ import annotations
+# Default Library.
+import asyncio
+import collections
+from typing import Deque, Dict, NamedTuple, Optional, Set, Tuple
+
+# Required by Red.
+import discord
+
+
+class Grant(NamedTuple):
+    member: discord.Member
+    role: discord.Role
+    reason: Optional[str]
+    future: asyncio.Future
+    queued_at: float  # Event loop time.
+
+
+class GrantDispatcher:
+    """Gives roles through one queue per guild, served round-robin with a global concurrency cap
+
+    As every grant is one API call, round-robin is as fair as deficit round-robin here:
+     a guild with thousands of queued grants delays the others by at most one grant per turn."""
+
+    WAIT_SAMPLES = 100  # The amount of recent waiting times that is kept per guild.
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.queues: Dict[int, Deque[Grant]] = {}
+        self.ring: Deque[int] = collections.deque()  # Guild IDs with queued grants, in turn order.
+        self.waits: Dict[int, Deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.WAIT_SAMPLES)
+        )
+        self.running = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.grant_tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """Stop dispatching, and cancel the running and queued grants"""
+        if self.task is not None:
+            self.task.cancel()
+        for task in self.grant_tasks:
+            task.cancel()
+        for queue in self.queues.values():
+            for grant in queue:
+                grant.future.cancel()
+        self.queues.clear()
+        self.ring.clear()
+
+    def set_concurrency(self, concurrency: int):
+        self.concurrency = concurrency
+        self.changed.set()
+
+    def submit(self, member: discord.Member, role: discord.Role, reason: str = None):
+        """Queue a role grant, and get a future that is done once the role has been given
+
+        The future raises the exception of add_roles if the grant failed."""
+        loop = asyncio.get_running_loop()
+        grant = Grant(member, role, reason, loop.create_future(), loop.time())
+        guild_id = member.guild.id
+        queue = self.queues.get(guild_id)
+        if queue is None:
+            queue = self.queues[guild_id] = collections.deque()
+            self.ring.append(guild_id)
+        queue.append(grant)
+        self.changed.set()
+        return grant.future
+
+    async def run(self):
+        while True:
+            while not self.ring or self.running >= self.concurrency:
+                self.changed.clear()
+                await self.changed.wait()
+            grant = self.next_grant()
+            self.running += 1
+            task = asyncio.create_task(self.give(grant))
+            self.grant_tasks.add(task)
+            task.add_done_callback(self.grant_tasks.discard)
+
+    def next_grant(self) -> Grant:
+        """Take the first grant of the guild whose turn it is, and move that guild to the back"""
+        guild_id = self.ring.popleft()
+        queue = self.queues[guild_id]
+        grant = queue.popleft()
+        if queue:
+            self.ring.append(guild_id)
+        else:
+            del self.queues[guild_id]
+        return grant
+
+    async def give(self, grant: Grant):
+        wait = asyncio.get_running_loop().time() - grant.queued_at
+        self.waits[grant.member.guild.id].append(wait)
+        try:
+            if not grant.future.cancelled():
+                await grant.member.add_roles(grant.role, reason=grant.reason)
+        except asyncio.CancelledError:
+            grant.future.cancel()
+            raise
+        except Exception as e:
+            if not grant.future.done():
+                grant.future.set_exception(e)
+        else:
+            if not grant.future.done():
+                grant.future.set_result(None)
+        finally:
+            self.running -= 1
+            self.changed.set()
+
+    def queue_status(self, guild_id: int) -> Tuple[int, float, float, float]:
+        """Get the queue depth, the age of the oldest queued grant, and the mean and max wait
+
+        The waiting times are those of the last WAIT_SAMPLES grants of the guild, in seconds."""
+        queue = self.queues.get(guild_id, ())
+        oldest = asyncio.get_running_loop().time() - queue[0].queued_at if queue else 0.0
+        waits = self.waits.get(guild_id, ())
+        mean_wait = sum(waits) / len(waits) if waits else 0.0
+        return len(queue), oldest, mean_wait, max(waits, default=0.0)
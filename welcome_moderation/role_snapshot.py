@@ -0,0 +1,122 @@
+from __future__ import annotations
+# Default Library.
+import array
+import bisect
+import hashlib
+import os
+from typing import Iterable, Iterator, Optional, Tuple
+
+# Required by Red.
+import discord
+
+
+def role_fingerprint(roles: Iterable[discord.Role]) -> int:
+    """Get a 64-bit fingerprint of a set of roles, which does not depend on their order"""
+    role_ids = array.array("Q", sorted(r.id for r in roles))
+    return int.from_bytes(hashlib.blake2b(role_ids.tobytes(), digest_size=8).digest(), "little")
+
+
+class RoleSnapshot:
+    """The role fingerprints of all members of a guild, in two arrays sorted on member ID
+
+    As a fingerprint only tells whether the roles changed, not how, the snapshot also has a flag
+     per member which tells whether the member had one tracked role (i.e. the verified role).
+    This takes 17 bytes per member, both in memory and on disk."""
+
+    __slots__ = ("role_id", "member_ids", "fingerprints", "has_role")
+
+    def __init__(
+        self,
+        role_id: int,
+        member_ids: array.array,
+        fingerprints: array.array,
+        has_role: bytearray,
+    ):
+        self.role_id = role_id
+        self.member_ids = member_ids
+        self.fingerprints = fingerprints
+        self.has_role = has_role
+
+    def __len__(self) -> int:
+        return len(self.member_ids)
+
+    @classmethod
+    def from_members(cls, role_id: int, members: Iterable[discord.Member]) -> RoleSnapshot:
+        snapshot = cls(role_id, array.array("Q"), array.array("Q"), bytearray())
+        for member in sorted(members, key=lambda m: m.id):
+            snapshot.member_ids.append(member.id)
+            snapshot.fingerprints.append(role_fingerprint(member.roles))
+            snapshot.has_role.append(snapshot.member_has_role(member))
+        return snapshot
+
+    @classmethod
+    def load(cls, fp: str, role_id: int) -> Optional[RoleSnapshot]:
+        """Read a snapshot written by save, or get None if there is no (complete) snapshot
+
+        A snapshot of another tracked role is not used either, as its flags do not apply."""
+        try:
+            with open(fp, "rb") as snapshot_f:
+                data = snapshot_f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < 16:
+            return None
+        count, saved_role_id = array.array("Q", data[:16])
+        if saved_role_id != role_id or len(data) != 16 + 17 * count:
+            return None
+        member_ids, fingerprints = array.array("Q"), array.array("Q")
+        member_ids.frombytes(data[16 : 16 + 8 * count])
+        fingerprints.frombytes(data[16 + 8 * count : 16 + 16 * count])
+        return cls(role_id, member_ids, fingerprints, bytearray(data[16 + 16 * count :]))
+
+    def save(self, fp: str):
+        """Write the snapshot atomically: the member count and role ID, the IDs, the fingerprints
+         and then the flags"""
+        tmp_fp = fp + ".tmp"
+        with open(tmp_fp, "wb") as snapshot_f:
+            array.array("Q", [len(self), self.role_id]).tofile(snapshot_f)
+            self.member_ids.tofile(snapshot_f)
+            self.fingerprints.tofile(snapshot_f)
+            snapshot_f.write(self.has_role)
+        os.replace(tmp_fp, fp)
+
+    def member_has_role(self, member: discord.Member) -> bool:
+        return any(r.id == self.role_id for r in member.roles)
+
+    def get(self, member_id: int) -> Optional[Tuple[int, bool]]:
+        """Get the fingerprint and flag of a member, or None if the member is not in the snapshot"""
+        i = bisect.bisect_left(self.member_ids, member_id)
+        if i < len(self.member_ids) and self.member_ids[i] == member_id:
+            return self.fingerprints[i], bool(self.has_role[i])
+        return None
+
+    def update(self, member: discord.Member):
+        """Set the fingerprint of a member, adding the member if it is not in the snapshot yet"""
+        fingerprint = role_fingerprint(member.roles)
+        has_role = self.member_has_role(member)
+        i = bisect.bisect_left(self.member_ids, member.id)
+        if i < len(self.member_ids) and self.member_ids[i] == member.id:
+            self.fingerprints[i] = fingerprint
+            self.has_role[i] = has_role
+        else:
+            self.member_ids.insert(i, member.id)
+            self.fingerprints.insert(i, fingerprint)
+            self.has_role.insert(i, has_role)
+
+    def remove(self, member_id: int):
+        i = bisect.bisect_left(self.member_ids, member_id)
+        if i < len(self.member_ids) and self.member_ids[i] == member_id:
+            del self.member_ids[i]
+            del self.fingerprints[i]
+            del self.has_role[i]
+
+    def changed_without_role(self, members: Iterable[discord.Member]) -> Iterator[discord.Member]:
+        """Yield the members that joined, or whose roles changed while they lacked the role
+
+        Members who had the tracked role are skipped, as its removal was deliberate."""
+        for member in members:
+            previous = self.get(member.id)
+            if previous is None or (
+                not previous[1] and previous[0] != role_fingerprint(member.roles)
+            ):
+                yield member
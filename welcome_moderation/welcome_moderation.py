@@ -3,14 +3,20 @@ from __future__ import annotations
 # Standard library.
 import asyncio
 import logging
+import os.path
+from typing import AsyncIterator
 
 # Required by Red.
 import discord
-from redbot.core import commands, Config
+from redbot.core import commands, Config, data_manager
 from redbot.core.bot import Red
 from redbot.core.commands import Cog, Context
 from redbot.core.utils.chat_formatting import box
-from redbot.core.utils.menus import SimpleMenu
+
+# Local.
+from .grant_dispatcher import GrantDispatcher
+from .lazy_menu import LazyMenu
+from .role_snapshot import RoleSnapshot
 
 
 class WelcomeModeration(Cog):
@@ -43,7 +49,10 @@ class WelcomeModeration(Cog):
     )
     OFF = "Disabled"
     ADDED_VER_ROLE = "Added the verified role to {}."
+    MISSED_REASON = "WelcomeModeration verification (role received while offline)."
+    RECONCILED = "Added the verified role to {} members in {} after reconnecting."
     UNASSIGN_TITLE = "Members without the verification role"
+    ALL_VERIFIED = "All members have the verification role."
     # verified_all_members strings.
     ALL_START = (
         "Verified check for all **`{}`** members started. "
@@ -64,6 +73,16 @@ class WelcomeModeration(Cog):
     )
     # Configuration overview strings.
     WM_STATUS_TITLE = "WelcomeModeration configuration for this server"
+    QUEUE_STATUS = (
+        "{} queued (oldest: {:.1f}s)\n"
+        "Wait over the last {} grants: {:.1f}s on average, {:.1f}s at most\n"
+        "Global limit: {} grants at a time"
+    )
+    # Grant concurrency strings.
+    CONCURRENCY_SET = (
+        DONE + "At most {} verified roles will be given at a time, across all servers."
+    )
+    CONCURRENCY_TOO_LOW = ":x: Error: at least one role must be given at a time."
     # Channel configuration strings.
     CHANNEL_SET = (
         DONE + "Successfully set the {m} messages to {c}. "
@@ -85,12 +104,17 @@ class WelcomeModeration(Cog):
     # Other constants.
     DEFAULT_VERIFIED_SECONDS = 30
     MAX_PAGE_SIZE = 20
+    MEMBER_BATCH = 1000  # The page size of fetch_members.
+    DEFAULT_GRANT_CONCURRENCY = 4
+    SNAPSHOT_INTERVAL = 600  # In seconds.
+    SNAPSHOT_NAME = "role_snapshot_{}.bin"
 
     def __init__(self, bot: Red):
         super().__init__()
         self.bot = bot
         self.log = logging.getLogger("red.hash_cogs.welcome_moderation")
         self.config = Config.get_conf(self, identifier=7509, force_registration=True)
+        self.config.register_global(grant_concurrency=self.DEFAULT_GRANT_CONCURRENCY)
         self.config.register_guild(
             verified_role_id=None,
             ignored_roles=[],  # Set with role ids.
@@ -100,12 +124,50 @@ class WelcomeModeration(Cog):
             welcome_channel_id=None,
             welcome_message="Welcome, {user}!",
         )
+        # All verified role grants go through this, such that no guild can starve the others.
+        self.dispatcher: GrantDispatcher | None = None
+        # The role snapshots of the reconciled guilds, kept up to date with the member events.
+        self.FOLDER = str(data_manager.cog_data_path(self))
+        self.snapshots: dict[int, RoleSnapshot] = {}
+        self.reconcile_lock = asyncio.Lock()
+        self.snapshot_task: asyncio.Task | None = None
+
+    async def cog_load(self):
+        self.dispatcher = GrantDispatcher(await self.config.grant_concurrency())
+        self.dispatcher.start()
+        self.snapshot_task = asyncio.create_task(self.snapshot_loop())
+
+    async def cog_unload(self):
+        if self.snapshot_task is not None:
+            self.snapshot_task.cancel()
+        await self.save_snapshots()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
 
     # Events
+    @Cog.listener()
+    async def on_disconnect(self):
+        # Role updates may be missed from now on, so save the snapshots while they are current.
+        # A resume replays the missed events, so only a new session (see on_ready) reconciles.
+        await self.save_snapshots()
+
+    @Cog.listener()
+    async def on_ready(self):
+        await self.reconcile_all(new_session=True)
+
+    @Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        snapshot = self.snapshots.get(payload.guild_id)
+        if snapshot is not None:
+            snapshot.remove(payload.user.id)
+
     @Cog.listener()
     async def on_member_join(self, member):
         """Sends a customisable welcome message to a guild"""
         gld = member.guild
+        snapshot = self.snapshots.get(gld.id)
+        if snapshot is not None:
+            snapshot.update(member)
         welcome_id = await self.config.guild(gld).welcome_channel_id()
         if welcome_id and not member.bot:  # Don't greet bots.
             welcome_message = await self.config.guild(gld).welcome_message()
@@ -116,6 +178,9 @@ class WelcomeModeration(Cog):
     async def on_member_update(self, m_old, m_new):
         """Give a member the verified role if they received an eligible role"""
         gld = m_new.guild
+        snapshot = self.snapshots.get(gld.id)
+        if snapshot is not None and m_old.roles != m_new.roles:
+            snapshot.update(m_new)
 
         new_role_id = next((r.id for r in m_new.roles if r not in m_old.roles), False)
         if new_role_id:  # Check whether the user gained a role.
@@ -145,7 +210,9 @@ class WelcomeModeration(Cog):
                 try:
                     check_role = discord.utils.get(gld.roles, id=verified_id)
                     # Assign the check role.
-                    await m_new.add_roles(check_role, reason="WelcomeModeration verification.")
+                    await self.dispatcher.submit(
+                        m_new, check_role, reason="WelcomeModeration verification."
+                    )
                 except discord.errors.Forbidden:
                     self.log.error(self.ROLE_ASSIGN_ERROR.format(gld.id))
 
@@ -168,23 +235,38 @@ class WelcomeModeration(Cog):
         verified_role = discord.utils.get(gld.roles, id=verified_id)
         if verified_role:
             await ctx.send(self.ALL_START.format(member_count))
-            for i, user in enumerate(gld.members, start=1):
+            i = 0
+            async for batch in self.member_batches(gld):
                 ignored_roles = await self.config.guild(gld).ignored_roles()
-                # Check if someone has a role that is not the default role, and not an ignored role.
-                if any(not r.is_default() and r.id not in ignored_roles for r in user.roles):
-                    if verified_role in user.roles:
-                        self.log.debug(f"{i} ALREADY VERIFIED, {user.id}")
+                # Queue the grants of the whole batch at once, the dispatcher interleaves them
+                # with the grants of other guilds. Members without a grant get their log status.
+                grants = []
+                for user in batch:
+                    # Ineligible if someone only has the default role and ignored roles.
+                    if all(r.is_default() or r.id in ignored_roles for r in user.roles):
+                        grants.append("INELIGIBLE")
+                    elif verified_role in user.roles:
+                        grants.append("ALREADY VERIFIED")
                     else:
-                        try:
-                            await user.add_roles(verified_role)
-                            self.log.debug(f"{i} ELIGIBLE, {user.id}")
-                        except discord.errors.Forbidden:
-                            self.log.error(self.ROLE_ASSIGN_ERROR.format(gld.id))
-                else:
-                    self.log.debug(f"{i} INELIGIBLE, {user.id}")
-                if i % 20 == 0:
-                    to_send = self.ALL_UPDATE.format(i, member_count, user.name)
-                    await ctx.send(to_send)
+                        grants.append(self.dispatcher.submit(user, verified_role))
+                try:
+                    for user, grant in zip(batch, grants):
+                        i += 1
+                        if isinstance(grant, str):
+                            self.log.debug(f"{i} {grant}, {user.id}")
+                        else:
+                            try:
+                                await grant
+                                self.log.debug(f"{i} ELIGIBLE, {user.id}")
+                            except discord.errors.Forbidden:
+                                self.log.error(self.ROLE_ASSIGN_ERROR.format(gld.id))
+                        if i % 20 == 0:
+                            to_send = self.ALL_UPDATE.format(i, member_count, user.name)
+                            await ctx.send(to_send)
+                finally:  # If the command stops early, the remaining grants are not given.
+                    for grant in grants:
+                        if not isinstance(grant, str):
+                            grant.cancel()
             to_send = f"All **`{member_count}`** members done!"
             await ctx.tick()
         else:
@@ -201,13 +283,17 @@ class WelcomeModeration(Cog):
         verified_role = discord.utils.get(gld.roles, id=verified_id)
 
         if verified_role:  # Create list of unverified users.
-            unverified_members = sorted(
-                (m for m in gld.members if verified_role not in m.roles), key=lambda x: x.joined_at
-            )
+            # Only (join date, ID) pairs are kept, such that no member objects stay in memory.
+            unverified_members = []
+            async for batch in self.member_batches(gld):
+                unverified_members.extend(
+                    (m.joined_at, m.id) for m in batch if verified_role not in m.roles
+                )
+            unverified_members.sort()
             unverified_n = len(unverified_members)
-            embed_list = []
             embed_count = 1 + ((unverified_n - 1) // self.MAX_PAGE_SIZE)
-            for i in range(embed_count):
+
+            def render_page(i: int) -> discord.Embed:
                 embed = discord.Embed(colour=discord.Colour.blurple(), title=self.UNASSIGN_TITLE)
                 embed.description = "Total unverified members: {}".format(unverified_n)
                 embed.set_footer(text=f"Page {i + 1} of {embed_count}.")
@@ -217,12 +303,16 @@ class WelcomeModeration(Cog):
                 # End is either the start + page size, or the remaining amount of members.
                 past_end: int = min(unverified_n, start + self.MAX_PAGE_SIZE)
                 field_str = "\n".join(
-                    "`{}` {}".format(mem_i + 1, unverified_members[mem_i].mention)
+                    "`{}` <@{}>".format(mem_i + 1, unverified_members[mem_i][1])
                     for mem_i in range(start, past_end)
                 )
                 embed.add_field(name=f"{start + 1}-{past_end}", value=field_str)
-                embed_list.append(embed)
-            await SimpleMenu(embed_list).start(ctx)
+                return embed
+
+            if unverified_n == 0:
+                await ctx.send(self.ALL_VERIFIED)
+            else:
+                await LazyMenu(embed_count, render_page).start(ctx)
         else:
             await ctx.send(self.NO_VER_ROLE)
 
@@ -261,6 +351,13 @@ class WelcomeModeration(Cog):
             else "No ignored roles."
         )
         embed.add_field(name="Ignored roles", value=block_str)
+
+        depth, oldest, mean_wait, max_wait = self.dispatcher.queue_status(gld.id)
+        sample_n = len(self.dispatcher.waits.get(gld.id, ()))
+        queue_str = self.QUEUE_STATUS.format(
+            depth, oldest, sample_n, mean_wait, max_wait, self.dispatcher.concurrency
+        )
+        embed.add_field(name="Verification queue", value=queue_str, inline=False)
         await ctx.send(embed=embed)
 
     @commands.group(name="wm_set", invoke_without_command=True)
@@ -331,6 +428,20 @@ class WelcomeModeration(Cog):
         await ctx.tick()
         await ctx.send(to_send)
 
+    @_config_guild.command(name="grant_concurrency")
+    @commands.is_owner()
+    async def set_grant_concurrency(self, ctx: Context, grants: int):
+        """Set how many verified roles may be given at the same time, across all servers
+
+        The servers take turns, so one server with many pending grants cannot stall the others."""
+        if grants < 1:
+            await ctx.send(self.CONCURRENCY_TOO_LOW)
+            return
+        await self.config.grant_concurrency.set(grants)
+        self.dispatcher.set_concurrency(grants)
+        await ctx.tick()
+        await ctx.send(self.CONCURRENCY_SET.format(grants))
+
     @_config_guild.command(name="confirmation_channel")
     @commands.guild_only()
     @commands.admin()
@@ -412,6 +523,102 @@ class WelcomeModeration(Cog):
         await ctx.send(to_send)
 
     # Utilities
+    async def member_batches(self, gld: discord.Guild) -> AsyncIterator[list[discord.Member]]:
+        """Yield the members of a guild in lists of at most MEMBER_BATCH members
+
+        If the member cache of the guild is incomplete (e.g. because member caching is disabled),
+         the members are fetched from Discord instead, keeping only one batch in memory."""
+        if gld.chunked:
+            members = gld.members
+            for start in range(0, len(members), self.MEMBER_BATCH):
+                yield members[start : start + self.MEMBER_BATCH]
+        else:
+            batch = []
+            async for member in gld.fetch_members(limit=None):
+                batch.append(member)
+                if len(batch) == self.MEMBER_BATCH:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def snapshot_path(self, guild_id: int) -> str:
+        return os.path.join(self.FOLDER, self.SNAPSHOT_NAME.format(guild_id))
+
+    async def snapshot_loop(self):
+        """Reconcile once the bot is ready, and then save the role snapshots periodically"""
+        await self.bot.wait_until_red_ready()
+        await self.reconcile_all()
+        while True:
+            await asyncio.sleep(self.SNAPSHOT_INTERVAL)
+            await self.save_snapshots()
+
+    async def reconcile_all(self, new_session: bool = False):
+        """Verify the members whose roles changed while the bot was offline, in all guilds
+
+        Only guilds with a verified role and a complete member cache are reconciled.
+        In a new gateway session, all guilds are reconciled again, as the events that happened
+         in between sessions are not replayed."""
+        async with self.reconcile_lock:
+            if new_session:
+                self.snapshots.clear()
+            guild_confs = await self.config.all_guilds()
+            to_reconcile = []
+            for guild_id, guild_conf in guild_confs.items():
+                gld = self.bot.get_guild(guild_id)
+                if (
+                    gld is not None
+                    and gld.chunked
+                    and guild_conf["verified_role_id"]
+                    and guild_id not in self.snapshots
+                ):
+                    to_reconcile.append(self.reconcile_guild(gld, guild_conf))
+            await asyncio.gather(*to_reconcile)
+
+    async def reconcile_guild(self, gld: discord.Guild, guild_conf: dict):
+        """Verify the members who joined or got roles since the saved snapshot, and take a new one
+
+        Members who had the verified role in the snapshot are never verified again, as the role
+         was then removed by hand while the bot was offline."""
+        verified_id = guild_conf["verified_role_id"]
+        verified_role = gld.get_role(verified_id)
+        snapshot = RoleSnapshot.load(self.snapshot_path(gld.id), verified_id)
+        if verified_role is not None and snapshot is not None:
+            ignored_roles = guild_conf["ignored_roles"]
+            grants = [
+                self.dispatcher.submit(m, verified_role, reason=self.MISSED_REASON)
+                for m in snapshot.changed_without_role(gld.members)
+                if verified_role not in m.roles
+                and any(not r.is_default() and r.id not in ignored_roles for r in m.roles)
+            ]
+            # The new snapshot is taken once the grants are done, such that it includes them.
+            results = await asyncio.gather(*grants, return_exceptions=True)
+            failed = sum(isinstance(r, BaseException) for r in results)
+            if failed:
+                self.log.error(self.ROLE_ASSIGN_ERROR.format(gld.id))
+            if grants:
+                self.log.info(self.RECONCILED.format(len(grants) - failed, gld.id))
+        # From now on, the member events keep the snapshot up to date.
+        self.snapshots[gld.id] = RoleSnapshot.from_members(verified_id, gld.members)
+        self.save_snapshot(gld.id)
+
+    async def save_snapshots(self):
+        guild_confs = await self.config.all_guilds()
+        for guild_id in list(self.snapshots):
+            verified_id = guild_confs.get(guild_id, {}).get("verified_role_id")
+            if verified_id == self.snapshots[guild_id].role_id:
+                self.save_snapshot(guild_id)
+            else:  # Verification was changed; reconcile from scratch once it is enabled again.
+                del self.snapshots[guild_id]
+
+    def save_snapshot(self, guild_id: int):
+        snapshot = self.snapshots.get(guild_id)
+        if snapshot is not None:
+            try:
+                snapshot.save(self.snapshot_path(guild_id))
+            except OSError:
+                self.log.exception(f"Could not save the role snapshot of {guild_id}.")
+
     def channel_mention(self, channel_id: int | None) -> str:
         """Return a channel ID (if provided) as a channel mention, else give a backup string"""
         return f"<#{channel_id}>" if channel_id else self.OFF